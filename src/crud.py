@@ -1,146 +1,279 @@
 # crud.py
 import logging
-import random
-from sqlalchemy.orm import Session
+import time
+import numpy as np
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
 from models import (
     DBShareholder, DBIndividualInvestor, DBMutualFund, DBPensionFund, 
     DBETF, DBHedgeFund, DBInsuranceCompany, DBBank, DBGovernmentFund, 
     ShareholderType, IndividualInvestorType, DBCompany, DBPortfolio, 
-    Order, Transaction, Sector, GlobalSettings, CEO
+    Order, Transaction, Sector, GlobalSettings, CEO, new_id
 )
 from schemas import OrderCreate, OrderType, OrderSubType
 from fastapi import BackgroundTasks
 import asyncio
-import uuid
-from sqlalchemy import func
-from database import SessionLocal 
-from typing import Optional
+from bisect import bisect_left
+from copy import deepcopy
+from functools import lru_cache
+from sqlalchemy import bindparam, case, delete, exists, func, insert, literal, select, text, true, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from database import AsyncSessionLocal
+from typing import List, NamedTuple, Optional
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
-def update_company_performance(db: Session, company_id: str):
-    company = get_company(db, company_id)
-    if not company:
+rng = np.random.default_rng()
+
+TICK_INTERVAL = 1.0  # seconds
+COMPANY_IDS_TTL = 1.0  # seconds; one tick of the background loops
+SIMULATION_DATE_TTL = 1.0  # seconds; the date moves once per company-update round and writes refresh it
+STATEMENTS_TTL = 1.0  # seconds; statements only move when update_company_daily runs, which drops them anyway
+EXISTS_TTL = 60.0  # companies and shareholders are never deleted, so a hit can't go stale
+
+# Short-lived in-process cache for data the background loops re-read every tick
+_cache = {}
+
+def _cache_get(key):
+    entry = _cache.get(key)
+    if entry is None or entry[0] <= time.monotonic():
         return None
+    return entry[1]
+
+def _cache_set(key, value, ttl: float):
+    _cache[key] = (time.monotonic() + ttl, value)
 
-    # Simple revenue generation (based on company size)
-    base_revenue = company.outstanding_shares * company.stock_price * 0.001  # Adjusted for daily revenue
-    revenue_fluctuation = random.uniform(0.95, 1.05)  # 5% daily fluctuation
-    company.revenue = base_revenue * revenue_fluctuation
+def invalidate_cache(key):
+    _cache.pop(key, None)
+
+def invalidate_statements(company_id: str):
+    for kind in ("income_statement", "balance_sheet", "cash_flow_statement"):
+        invalidate_cache((kind, company_id))
+
+def _exists(db: Session, model, id: str) -> bool:
+    # Only positive answers are cached; a missing id may be created a moment later
+    key = (model.__tablename__, id)
+    if _cache_get(key):
+        return True
+    found = db.execute(select(model.id).where(model.id == id)).first() is not None
+    if found:
+        _cache_set(key, True, EXISTS_TTL)
+    return found
+
+def calculate_companies_performance(outstanding_shares, stock_price, total_profit, days_active, days: int = 1):
+    # Simple revenue generation (based on company size), evaluated for every company at once.
+    # With days > 1 each row of the draws is one day; totals take every day, the reported figures the last one
+    count = len(outstanding_shares)
+    base_revenue = np.asarray(outstanding_shares, dtype=np.float64) * np.asarray(stock_price, dtype=np.float64) * 0.001  # Adjusted for daily revenue
+    revenue = base_revenue * rng.uniform(0.95, 1.05, (days, count))  # 5% daily fluctuation
 
     # Simple cost calculation (70-90% of revenue)
-    cost_ratio = random.uniform(0.7, 0.9)
-    company.costs = company.revenue * cost_ratio
+    costs = revenue * rng.uniform(0.7, 0.9, (days, count))
 
     # Calculate daily profit
-    daily_profit = company.revenue - company.costs
-    
-    # Update company financials
-    company.profit = daily_profit
-    company.total_profit += daily_profit
-    company.days_active += 1
+    daily_profit = revenue - costs
 
-    db.add(company)
-    db.commit()
-    db.refresh(company)
+    return {
+        "revenue": revenue[-1],
+        "costs": costs[-1],
+        "profit": daily_profit[-1],
+        "total_profit": np.nan_to_num(np.asarray(total_profit, dtype=np.float64)) + daily_profit.sum(axis=0),
+        "days_active": np.asarray([active or 0 for active in days_active], dtype=np.int64) + days
+    }
+
+def update_company_performance(db: Session, company: DBCompany):
+    # Takes the already-loaded company so callers iterating over companies don't re-fetch each one
+    # Update company financials
+    performance = calculate_companies_performance(
+        [company.outstanding_shares], [company.stock_price], [company.total_profit], [company.days_active]
+    )
+    for key, values in performance.items():
+        setattr(company, key, values.tolist()[0])
 
+    # The caller owns the transaction and commits once per tick
     return company
 
 async def run_company_ticks():
-    while True:
-        db = SessionLocal()
-        try:
-            companies = get_all_companies(db)
-            for company in companies:
-                update_company_performance(db, company.id)
-            db.commit()
-            await asyncio.sleep(1)  # Wait for 1 second before the next tick
-        except Exception as e:
-            logger.error(f"Error in run_company_ticks: {str(e)}")
-            db.rollback()
-        finally:
-            db.close()
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    days = 1
+    # One session for the life of the loop; each tick is its own transaction on it
+    async with AsyncSessionLocal() as db:
+        while True:
+            next_tick += TICK_INTERVAL
+            try:
+                async with db.begin():
+                    if db.get_bind().dialect.name == "postgresql":
+                        # A lost tick is harmless, don't wait for the WAL flush on commit
+                        await db.execute(text("SET LOCAL synchronous_commit = off"))
+                    # One SELECT for the whole tick, then one bulk UPDATE by primary key
+                    companies = (await db.execute(select(
+                        DBCompany.id, DBCompany.outstanding_shares, DBCompany.stock_price,
+                        DBCompany.total_profit, DBCompany.days_active
+                    ))).all()
+                    if companies:
+                        ids, outstanding_shares, stock_price, total_profit, days_active = zip(*companies)
+                        performance = calculate_companies_performance(outstanding_shares, stock_price, total_profit, days_active, days)
+                        updates = [
+                            {"id": company_id, "revenue": revenue, "costs": costs, "profit": profit,
+                             "total_profit": total, "days_active": active}
+                            for company_id, revenue, costs, profit, total, active in zip(
+                                ids,
+                                performance["revenue"].tolist(),
+                                performance["costs"].tolist(),
+                                performance["profit"].tolist(),
+                                performance["total_profit"].tolist(),
+                                performance["days_active"].tolist()
+                            )
+                        ]
+                        await db.execute(update(DBCompany), updates)
+            except Exception as e:
+                # Leaving the begin() block rolls the tick back, the session stays usable
+                logger.error("Error in run_company_ticks: %s", e)
+            # Sleep until the next tick boundary so the work time doesn't add to the period.
+            # When a tick overran, still yield to the loop once and restart the schedule from now;
+            # whole periods it ran over are folded into the next tick instead of being dropped
+            delay = next_tick - loop.time()
+            days = 1
+            if delay < 0:
+                days += int(-delay // TICK_INTERVAL)
+                next_tick = loop.time()
+            await asyncio.sleep(max(0, delay))
 
 def update_stock_price(db: Session, company_id: str):
     company = get_company(db, company_id)
     if not company:
-        logger.error(f"Company not found: {company_id}")
+        logger.error("Company not found: %s", company_id)
         return None
 
-    # First, check for the lowest current sell limit order price
-    lowest_sell_limit = db.query(Order).filter(
-        Order.company_id == company_id,
-        Order.order_type == OrderType.SELL,
-        Order.order_subtype == OrderSubType.LIMIT
-    ).order_by(Order.price.asc()).first()
-
-    if lowest_sell_limit:
-        new_price = lowest_sell_limit.price
-        logger.info(f"Setting price based on lowest sell limit order: ${new_price}")
+    # Fetch both price sources in one round trip: the lowest current sell limit order and the latest transaction
+    lowest_sell_limit_price, latest_transaction_price = db.execute(select(
+        select(Order.price).where(
+            Order.company_id == company_id,
+            Order.order_type == OrderType.SELL,
+            Order.order_subtype == OrderSubType.LIMIT
+        ).order_by(Order.price.asc()).limit(1).scalar_subquery(),
+        select(Transaction.price_per_share)
+        .where(Transaction.company_id == company_id)
+        .order_by(Transaction.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )).one()
+
+    if lowest_sell_limit_price is not None:
+        new_price = lowest_sell_limit_price
+        logger.info("Setting price based on lowest sell limit order: $%s", new_price)
     else:
-        # If no sell limit orders, get the latest transaction price
-        latest_transaction = db.query(Transaction).filter(
-            Transaction.company_id == company_id
-        ).order_by(Transaction.id.desc()).first()
-        
-        if latest_transaction:
-            new_price = latest_transaction.price_per_share
-            logger.info(f"Setting price based on latest transaction: ${new_price}")
+        # If no sell limit orders, use the latest transaction price
+        if latest_transaction_price is not None:
+            new_price = latest_transaction_price
+            logger.info("Setting price based on latest transaction: $%s", new_price)
         else:
             # If no transactions and no sell limit orders, keep the current price
             new_price = company.stock_price
-            logger.info(f"No new price found, keeping current price: ${new_price}")
+            logger.info("No new price found, keeping current price: $%s", new_price)
 
     if new_price != company.stock_price:
         company.stock_price = new_price
         db.add(company)
         db.commit()
-        logger.info(f"Updated stock price for company {company_id} to ${new_price}")
+        logger.info("Updated stock price for company %s to $%s", company_id, new_price)
     else:
-        logger.info(f"Stock price for company {company_id} remains unchanged at ${new_price}")
+        logger.info("Stock price for company %s remains unchanged at $%s", company_id, new_price)
 
     return company.stock_price
 
-def create_shareholder(db: Session, name: str, initial_cash: float, type: ShareholderType, subtype: IndividualInvestorType = None):
-    shareholder_id = str(uuid.uuid4())
-    
-    if type != ShareholderType.INDIVIDUAL and subtype is not None:
-        raise ValueError(f"Subtype should not be provided for {type.value}")
-
+def refresh_all_stock_prices(db: Session):
+    # Same rule as update_stock_price (lowest sell limit, else last trade, else unchanged) for every company in one UPDATE
+    lowest_sell_limit_price = select(func.min(Order.price)).where(
+        Order.company_id == DBCompany.id,
+        Order.order_type == OrderType.SELL,
+        Order.order_subtype == OrderSubType.LIMIT
+    ).scalar_subquery()
+    latest_transaction_price = (
+        select(Transaction.price_per_share)
+        .where(Transaction.company_id == DBCompany.id)
+        .order_by(Transaction.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    new_price = func.coalesce(lowest_sell_limit_price, latest_transaction_price, DBCompany.stock_price)
+    # Rows whose price didn't move are left alone, so an idle round writes nothing
+    result = db.execute(
+        update(DBCompany)
+        .where(DBCompany.stock_price.is_distinct_from(new_price))
+        .values(stock_price=new_price)
+        .execution_options(synchronize_session=False)  # the commit below expires loaded companies anyway
+    )
+    db.commit()
+    logger.info("Changed stock prices for %s companies", result.rowcount)
+    return result.rowcount
+
+SHAREHOLDER_CLASSES = {
+    ShareholderType.INDIVIDUAL: DBIndividualInvestor,
+    ShareholderType.MUTUAL_FUND: DBMutualFund,
+    ShareholderType.PENSION_FUND: DBPensionFund,
+    ShareholderType.ETF: DBETF,
+    ShareholderType.HEDGE_FUND: DBHedgeFund,
+    ShareholderType.INSURANCE_COMPANY: DBInsuranceCompany,
+    ShareholderType.BANK: DBBank,
+    ShareholderType.GOVERNMENT_FUND: DBGovernmentFund,
+}
+
+def validate_shareholder_type(type: ShareholderType, subtype: IndividualInvestorType = None):
+    if type not in SHAREHOLDER_CLASSES:
+        raise ValueError(f"Invalid shareholder type: {type}")
     if type == ShareholderType.INDIVIDUAL:
         if subtype is None:
             raise ValueError("Subtype must be provided for Individual Investors")
+    elif subtype is not None:
+        raise ValueError(f"Subtype should not be provided for {type.value}")
+
+def create_shareholder(db: Session, name: str, initial_cash: float, type: ShareholderType, subtype: IndividualInvestorType = None):
+    shareholder_id = new_id()
+    validate_shareholder_type(type, subtype)
+
+    if type == ShareholderType.INDIVIDUAL:
         db_shareholder = DBIndividualInvestor(id=shareholder_id, name=name, cash=initial_cash, type=type, subtype=subtype)
-    elif type in [ShareholderType.MUTUAL_FUND, ShareholderType.PENSION_FUND, ShareholderType.ETF,
-                  ShareholderType.HEDGE_FUND, ShareholderType.INSURANCE_COMPANY, ShareholderType.BANK,
-                  ShareholderType.GOVERNMENT_FUND]:
-        if subtype is not None:
-            raise ValueError(f"Subtype should not be provided for {type.value}")    
-        if type == ShareholderType.MUTUAL_FUND:
-            db_shareholder = DBMutualFund(id=shareholder_id, name=name, cash=initial_cash, type=type)
-        elif type == ShareholderType.PENSION_FUND:
-            db_shareholder = DBPensionFund(id=shareholder_id, name=name, cash=initial_cash, type=type)
-        elif type == ShareholderType.ETF:
-            db_shareholder = DBETF(id=shareholder_id, name=name, cash=initial_cash, type=type)
-        elif type == ShareholderType.HEDGE_FUND:
-            db_shareholder = DBHedgeFund(id=shareholder_id, name=name, cash=initial_cash, type=type)
-        elif type == ShareholderType.INSURANCE_COMPANY:
-            db_shareholder = DBInsuranceCompany(id=shareholder_id, name=name, cash=initial_cash, type=type)
-        elif type == ShareholderType.BANK:
-            db_shareholder = DBBank(id=shareholder_id, name=name, cash=initial_cash, type=type)
-        elif type == ShareholderType.GOVERNMENT_FUND:
-            db_shareholder = DBGovernmentFund(id=shareholder_id, name=name, cash=initial_cash, type=type)
     else:
-        raise ValueError(f"Invalid shareholder type: {type}")
+        db_shareholder = SHAREHOLDER_CLASSES[type](id=shareholder_id, name=name, cash=initial_cash, type=type)
     
     db.add(db_shareholder)
     db.commit()
-    db.refresh(db_shareholder)
     return db_shareholder
 
+def create_shareholders_bulk(db: Session, shareholders: List[dict]) -> List[str]:
+    # Each item: {"name", "initial_cash", "type", optional "subtype"}; one executemany per shareholder class
+    rows_by_class = {}
+    shareholder_ids = []
+    for shareholder in shareholders:
+        type = shareholder["type"]
+        subtype = shareholder.get("subtype")
+        validate_shareholder_type(type, subtype)
+
+        row = {"id": new_id(), "name": shareholder["name"], "cash": shareholder["initial_cash"], "type": type}
+        if type == ShareholderType.INDIVIDUAL:
+            row["subtype"] = subtype
+        rows_by_class.setdefault(SHAREHOLDER_CLASSES[type], []).append(row)
+        shareholder_ids.append(row["id"])
+
+    for shareholder_class, rows in rows_by_class.items():
+        db.execute(insert(shareholder_class), rows)
+    db.commit()
+    return shareholder_ids
+
 def get_shareholder(db: Session, shareholder_id: str):
-    return db.query(DBShareholder).filter(DBShareholder.id == shareholder_id).first()
+    return db.get(DBShareholder, shareholder_id)
+
+# Built once: the matcher runs these per fill, and rebuilding the select costs more than executing it
+_SHAREHOLDER_CASH_STMT = select(DBShareholder.cash).where(DBShareholder.id == bindparam("shareholder_id"))
+
+def get_shareholder_cash(db: Session, shareholder_id: str) -> Optional[float]:
+    # Column-only read for the hot paths that just need the balance; skips hydrating the shareholder
+    return db.execute(_SHAREHOLDER_CASH_STMT, {"shareholder_id": shareholder_id}).scalar_one_or_none()
+
+def shareholder_exists(db: Session, shareholder_id: str) -> bool:
+    return _exists(db, DBShareholder, shareholder_id)
 
 def get_all_shareholders(db: Session):
     return db.query(DBShareholder).all()
@@ -151,7 +284,7 @@ def create_company(db: Session, name: str, initial_stock_price: float, initial_s
         return None
     
     try:
-        company_id = str(uuid.uuid4())
+        company_id = new_id()
         new_ceo = CEO.generate_random_ceo()
         
         db_company = DBCompany(
@@ -169,11 +302,11 @@ def create_company(db: Session, name: str, initial_stock_price: float, initial_s
         db.add(db_portfolio)
         
         db.commit()
-        db.refresh(db_company)
+        invalidate_cache("company_ids")
         return db_company
     except Exception as e:
         db.rollback()
-        logger.error(f"Error creating company: {str(e)}")
+        logger.error("Error creating company: %s", e)
         return None
 
 def change_ceo(db: Session, company_id: str, shareholder_id: str):
@@ -203,96 +336,202 @@ def change_ceo(db: Session, company_id: str, shareholder_id: str):
     company.ceo = new_ceo
     
     db.commit()
-    db.refresh(company)
     
-    # Delete the old CEO
+    # Delete the old CEO in its own commit: deleting it in the same flush would insert the new CEO
+    # while the old row still holds the unique company_id
     if old_ceo:
         db.delete(old_ceo)
         db.commit()
+    invalidate_statements(company_id)
     
     return company, f"CEO changed successfully. Cost: ${change_cost:.2f}"
 
 def get_company(db: Session, company_id: str):
-    return db.query(DBCompany).filter(DBCompany.id == company_id).first()
+    return db.get(DBCompany, company_id)
+
+class CompanySnapshot(NamedTuple):
+    company: DBCompany
+    shares: int  # the shareholder's holding, 0 without one
+
+def get_company_snapshot(db: Session, company_id: str, shareholder_id: str = None) -> Optional[CompanySnapshot]:
+    # The company, its CEO and one shareholder's holding in a single SELECT, for views that need all three
+    shares = select(DBPortfolio.shares).where(
+        DBPortfolio.company_id == DBCompany.id,
+        DBPortfolio.shareholder_id == shareholder_id
+    ).scalar_subquery()
+    row = db.execute(
+        select(DBCompany, func.coalesce(shares, 0)).options(joinedload(DBCompany.ceo)).where(DBCompany.id == company_id)
+    ).first()
+    return CompanySnapshot(*row) if row else None
 
 def get_all_companies(db: Session):
     return db.query(DBCompany).all()
 
-def create_order(db: Session, order: OrderCreate):
+def get_company_ids(db: Session) -> List[str]:
+    company_ids = _cache_get("company_ids")
+    if company_ids is None:
+        company_ids = list(db.execute(select(DBCompany.id)).scalars())
+        _cache_set("company_ids", company_ids, COMPANY_IDS_TTL)
+    return company_ids
+
+def company_exists(db: Session, company_id: str) -> bool:
+    return _exists(db, DBCompany, company_id)
+
+def get_all_companies_with_ceo(db: Session):
+    # For callers that serialize company.ceo; avoids one lazy SELECT per company
+    return db.query(DBCompany).options(selectinload(DBCompany.ceo)).all()
+
+def _order_balance_subqueries(order: OrderCreate):
+    current_shares_subq = select(DBPortfolio.shares).where(
+        DBPortfolio.shareholder_id == order.shareholder_id,
+        DBPortfolio.company_id == order.company_id
+    ).limit(1).scalar_subquery()
+
+    # Open buy shares and limit-buy cost in one pass over the shareholder's BUY orders
+    buy_totals = select(
+        func.coalesce(func.sum(Order.shares), 0).label("shares"),
+        func.coalesce(func.sum(case(
+            (Order.order_subtype == OrderSubType.LIMIT, Order.shares * Order.price), else_=0
+        )), 0).label("cost")
+    ).where(
+        Order.shareholder_id == order.shareholder_id,
+        Order.company_id == order.company_id,
+        Order.order_type == OrderType.BUY
+    ).subquery()
+
+    return current_shares_subq, buy_totals
+
+def get_order_rejection_reason(db: Session, order: OrderCreate) -> Optional[str]:
+    current_shares_subq, buy_totals = _order_balance_subqueries(order)
+
+    # Fetch everything the checks below need in a single round trip
+    row = db.execute(
+        select(
+            DBShareholder.cash,
+            DBCompany.id,
+            DBCompany.outstanding_shares,
+            current_shares_subq,
+            buy_totals.c.shares,
+            buy_totals.c.cost
+        )
+        .select_from(DBShareholder)
+        .outerjoin(DBCompany, DBCompany.id == order.company_id)
+        .join(buy_totals, true())
+        .where(DBShareholder.id == order.shareholder_id)
+    ).first()
+
     # Check if the shareholder exists
-    shareholder = db.query(DBShareholder).filter(DBShareholder.id == order.shareholder_id).first()
-    if not shareholder:
-        return None, f"Shareholder not found: {order.shareholder_id}"
+    if row is None:
+        return f"Shareholder not found: {order.shareholder_id}"
+    cash, company_id, outstanding_shares, portfolio_shares, current_buy_orders, total_buy_orders_cost = row
 
     # Check if the company exists
-    company = get_company(db, order.company_id)
-    if not company:
-        return None, f"Company not found: {order.company_id}"
+    if company_id is None:
+        return f"Company not found: {order.company_id}"
+
+    current_shares = portfolio_shares if portfolio_shares is not None else 0
 
     if order.order_type == OrderType.BUY:
         if order.order_subtype == OrderSubType.LIMIT:
             # Check if the shareholder has enough cash for limit buy orders
             total_cost = order.shares * order.price
-            if shareholder.cash < total_cost:
-                return None, f"Insufficient funds. Required: {total_cost}, Available: {shareholder.cash}"
-
-        # Get shareholder's current portfolio
-        portfolio = get_portfolio(db, order.shareholder_id, order.company_id)
-        current_shares = portfolio.shares if portfolio else 0
-
-        # Get shareholder's current buy orders
-        current_buy_orders = db.query(func.sum(Order.shares)).filter(
-            Order.shareholder_id == order.shareholder_id,
-            Order.company_id == order.company_id,
-            Order.order_type == OrderType.BUY
-        ).scalar() or 0
+            if cash < total_cost:
+                return f"Insufficient funds. Required: {total_cost}, Available: {cash}"
 
         # Calculate available shares for this shareholder
-        available_shares = company.outstanding_shares - current_shares - current_buy_orders
+        available_shares = outstanding_shares - current_shares - current_buy_orders
 
         if order.shares > available_shares:
-            return None, f"Not enough available shares. Requested: {order.shares}, Available: {available_shares}"
+            return f"Not enough available shares. Requested: {order.shares}, Available: {available_shares}"
 
         if order.order_subtype == OrderSubType.LIMIT:
             # Check if total cost of all buy orders (including this one) exceeds available cash
-            total_buy_orders_cost = db.query(func.sum(Order.shares * Order.price)).filter(
-                Order.shareholder_id == order.shareholder_id,
-                Order.company_id == order.company_id,
-                Order.order_type == OrderType.BUY,
-                Order.order_subtype == OrderSubType.LIMIT
-            ).scalar() or 0
             total_buy_orders_cost += total_cost
 
-            if total_buy_orders_cost > shareholder.cash:
-                return None, f"Insufficient funds for all buy orders. Required: {total_buy_orders_cost}, Available: {shareholder.cash}"
+            if total_buy_orders_cost > cash:
+                return f"Insufficient funds for all buy orders. Required: {total_buy_orders_cost}, Available: {cash}"
 
     elif order.order_type == OrderType.SELL:
         # Check if the shareholder owns enough shares
-        portfolio = get_portfolio(db, order.shareholder_id, order.company_id)
-        if not portfolio or portfolio.shares < order.shares:
-            return None, f"Insufficient shares. Required: {order.shares}, Available: {portfolio.shares if portfolio else 0}"
-
-    # If all checks pass, create the order
-    db_order = Order(
-        id=str(uuid.uuid4()),
-        shareholder_id=order.shareholder_id,
-        company_id=order.company_id,
-        order_type=order.order_type,
-        order_subtype=order.order_subtype,
-        shares=order.shares,
-        price=order.price if order.order_subtype == OrderSubType.LIMIT else None
-    )
-    db.add(db_order)
+        if portfolio_shares is None or portfolio_shares < order.shares:
+            return f"Insufficient shares. Required: {order.shares}, Available: {current_shares}"
+
+    return None
+
+def create_order(db: Session, order: OrderCreate):
+    current_shares_subq, buy_totals = _order_balance_subqueries(order)
+    price = order.price if order.order_subtype == OrderSubType.LIMIT else None
+
+    # The balance checks run inside the INSERT so nothing can change between check and insert
+    guards = [
+        exists().where(DBShareholder.id == order.shareholder_id),
+        exists().where(DBCompany.id == order.company_id)
+    ]
+    if order.order_type == OrderType.BUY:
+        conditions = [
+            DBCompany.outstanding_shares - func.coalesce(current_shares_subq, 0) - buy_totals.c.shares >= order.shares
+        ]
+        if order.order_subtype == OrderSubType.LIMIT:
+            conditions.append(DBShareholder.cash >= buy_totals.c.cost + order.shares * price)
+        guards.append(exists(
+            select(1)
+            .select_from(DBCompany)
+            .join(DBShareholder, true())
+            .join(buy_totals, true())
+            .where(DBCompany.id == order.company_id, DBShareholder.id == order.shareholder_id, *conditions)
+        ))
+    elif order.order_type == OrderType.SELL:
+        guards.append(current_shares_subq >= order.shares)
+
+    columns = Order.__table__.c
+    stmt = insert(Order).from_select(
+        ["id", "shareholder_id", "company_id", "order_type", "order_subtype", "shares", "price"],
+        select(
+            literal(new_id()),
+            literal(order.shareholder_id),
+            literal(order.company_id),
+            literal(order.order_type, columns.order_type.type),
+            literal(order.order_subtype, columns.order_subtype.type),
+            literal(order.shares),
+            literal(price, columns.price.type)
+        ).where(*guards)
+    ).returning(Order)
+
     try:
-        db.commit()
-        db.refresh(db_order)
-        return db_order, None
+        db_order = db.scalars(stmt).first()
+        if db_order is not None:
+            db.commit()
+            return db_order, None
     except Exception as e:
         db.rollback()
         return None, f"Error committing order to database: {str(e)}"
-    
+
+    # Nothing was inserted, look up which check failed to report it
+    reason = get_order_rejection_reason(db, order)
+    db.rollback()
+    return None, reason or "Order rejected because balances changed while it was being placed. Please retry."
+
+def create_orders_bulk(db: Session, orders: List[OrderCreate]) -> List[str]:
+    # Inserts pre-validated orders (e.g. from simulated traders) in a single executemany
+    rows = [
+        {
+            "id": new_id(),
+            "shareholder_id": order.shareholder_id,
+            "company_id": order.company_id,
+            "order_type": order.order_type,
+            "order_subtype": order.order_subtype,
+            "shares": order.shares,
+            "price": order.price if order.order_subtype == OrderSubType.LIMIT else None
+        }
+        for order in orders
+    ]
+    if rows:
+        db.execute(insert(Order), rows)
+        db.commit()
+    return [row["id"] for row in rows]
+
 def cancel_order(db: Session, order_id: str):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = db.get(Order, order_id)
     if order:
         db.delete(order)
         db.commit()
@@ -300,14 +539,16 @@ def cancel_order(db: Session, order_id: str):
     return False
 
 def get_shareholder_orders(db: Session, shareholder_id: str):
-    return db.query(Order).filter(Order.shareholder_id == shareholder_id).all()
+    # Callers show the company next to each order; join it in rather than one lookup per row
+    return db.query(Order).options(joinedload(Order.company)).filter(Order.shareholder_id == shareholder_id).all()
 
 def get_shareholder_portfolio(db: Session, shareholder_id: str):
-    return db.query(DBPortfolio).filter(DBPortfolio.shareholder_id == shareholder_id).all()
+    return db.query(DBPortfolio).options(joinedload(DBPortfolio.company)).filter(DBPortfolio.shareholder_id == shareholder_id).all()
 
 def get_order_book(db: Session, company_id: str):
-    buy_orders = db.query(Order).filter(Order.company_id == company_id, Order.order_type == OrderType.BUY).all()
-    sell_orders = db.query(Order).filter(Order.company_id == company_id, Order.order_type == OrderType.SELL).all()
+    orders = db.query(Order).filter(Order.company_id == company_id).all()
+    buy_orders = [o for o in orders if o.order_type == OrderType.BUY]
+    sell_orders = [o for o in orders if o.order_type == OrderType.SELL]
     return {'buy': buy_orders, 'sell': sell_orders}
 
 def get_pending_sell_orders(db: Session, shareholder_id: str, company_id: str) -> int:
@@ -324,54 +565,206 @@ def get_portfolio(db: Session, shareholder_id: str, company_id: str) -> Optional
         DBPortfolio.company_id == company_id
     ).first()
 
-def update_company_shares(db: Session, company_id: str):
-    company = get_company(db, company_id)
-    if company:
-        total_shares = db.query(func.sum(DBPortfolio.shares)).filter(
-            DBPortfolio.company_id == company_id
-        ).scalar() or 0
-        company.outstanding_shares = total_shares
-        db.commit()
-        return True
-    return False
+_PORTFOLIO_SHARES_STMT = select(DBPortfolio.shares).where(
+    DBPortfolio.shareholder_id == bindparam("shareholder_id"),
+    DBPortfolio.company_id == bindparam("company_id")
+)
+
+def get_portfolio_shares(db: Session, shareholder_id: str, company_id: str) -> int:
+    shares = db.execute(
+        _PORTFOLIO_SHARES_STMT, {"shareholder_id": shareholder_id, "company_id": company_id}
+    ).scalar_one_or_none()
+    return shares or 0
 
-def execute_transaction(db: Session, transaction: Transaction):
-    db.add(transaction)
+def update_company_shares(db: Session, company_id: str):
+    # outstanding_shares is kept in step on every issue/retire; this full recount is only for repairs
+    # Recount and store outstanding shares in one statement
+    total_shares = select(func.coalesce(func.sum(DBPortfolio.shares), 0)).where(
+        DBPortfolio.company_id == company_id
+    ).scalar_subquery()
+    result = db.execute(
+        update(DBCompany).where(DBCompany.id == company_id).values(outstanding_shares=total_shares)
+    )
     db.commit()
-    db.refresh(transaction)
-    return transaction
+    return result.rowcount > 0
+
+def record_transactions(db: Session, rows: List[dict]) -> List[dict]:
+    # Plain Core executemany, fills don't need the ORM unit of work; the caller commits
+    for row in rows:
+        row.setdefault("id", new_id())
+    if rows:
+        db.execute(insert(Transaction.__table__), rows)
+    return rows
+
+def execute_transactions(db: Session, rows: List[dict]) -> List[dict]:
+    record_transactions(db, rows)
+    db.commit()
+    return rows
+
+def execute_transaction(db: Session, buyer_id: str, seller_id: str, company_id: str, shares: int, price_per_share: float) -> dict:
+    return execute_transactions(db, [{
+        "buyer_id": buyer_id,
+        "seller_id": seller_id,
+        "company_id": company_id,
+        "shares": shares,
+        "price_per_share": price_per_share
+    }])[0]
+
+def _portfolio_upsert(dialect_insert):
+    stmt = dialect_insert(DBPortfolio.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["shareholder_id", "company_id"],
+        set_={"shares": DBPortfolio.__table__.c.shares + stmt.excluded.shares}
+    )
+
+# Adds to a holding or opens it, keyed on ix_portfolios_shareholder_company
+_PORTFOLIO_UPSERT_STMTS = {"sqlite": _portfolio_upsert(sqlite.insert), "postgresql": _portfolio_upsert(postgresql.insert)}
+
+def add_portfolio_shares(db: Session, rows: List[dict]):
+    # No commit here; each row is {"shareholder_id", "company_id", "shares"}
+    upsert = _PORTFOLIO_UPSERT_STMTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        db.execute(upsert, rows)
+        return
+    # No ON CONFLICT on this dialect, so update the holdings that exist and insert the rest
+    for row in rows:
+        holding = (DBPortfolio.shareholder_id == row["shareholder_id"], DBPortfolio.company_id == row["company_id"])
+        result = db.execute(update(DBPortfolio).where(*holding).values(shares=DBPortfolio.shares + row["shares"]))
+        if result.rowcount == 0:
+            db.execute(insert(DBPortfolio).values(**row))
+
+def change_portfolio_shares(db: Session, shareholder_id: str, company_id: str, shares_change: int) -> int:
+    # No commit here, so a fill's share and cash moves can share one transaction.
+    # Returns the change actually applied: a debit larger than the holding only removes what was there
+    if shares_change > 0:
+        # Opens the holding or adds to it in one round trip
+        add_portfolio_shares(db, [{"shareholder_id": shareholder_id, "company_id": company_id, "shares": shares_change}])
+        return shares_change
+    holding = (DBPortfolio.shareholder_id == shareholder_id, DBPortfolio.company_id == company_id)
+    # Apply the change server-side so concurrent fills cannot lose updates
+    # RETURNING hands back the new balance, so the DELETE only runs when a holding actually empties
+    new_shares = db.execute(
+        update(DBPortfolio).where(*holding).values(shares=DBPortfolio.shares + shares_change).returning(DBPortfolio.shares)
+    ).scalar()
+    if new_shares is None:
+        return 0
+    elif new_shares <= 0:
+        db.execute(delete(DBPortfolio).where(*holding))
+        return shares_change - new_shares
+    return shares_change
 
 def update_shareholder_portfolio(db: Session, shareholder_id: str, company_id: str, shares_change: int):
-    portfolio = get_portfolio(db, shareholder_id, company_id)
-    if portfolio:
-        portfolio.shares += shares_change
-        if portfolio.shares <= 0:
-            db.delete(portfolio)
-        else:
-            db.add(portfolio)
-    elif shares_change > 0:
-        new_portfolio = DBPortfolio(shareholder_id=shareholder_id, company_id=company_id, shares=shares_change)
-        db.add(new_portfolio)
+    # Outside of a fill (see apply_fill) shares are issued or retired, so the company total moves with them
+    applied_change = change_portfolio_shares(db, shareholder_id, company_id, shares_change)
+    if applied_change:
+        db.execute(
+            update(DBCompany)
+            .where(DBCompany.id == company_id)
+            .values(outstanding_shares=DBCompany.outstanding_shares + applied_change)
+        )
     db.commit()
-    logger.info(f"Updated portfolio for shareholder {shareholder_id}: {shares_change} shares change")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Updated portfolio for shareholder %s: %s shares change", shareholder_id, shares_change)
+
+def change_shareholder_cash(db: Session, shareholder_id: str, cash_change: float) -> bool:
+    result = db.execute(
+        update(DBShareholder).where(DBShareholder.id == shareholder_id).values(cash=DBShareholder.cash + cash_change)
+    )
+    return result.rowcount > 0
 
 def update_shareholder_cash(db: Session, shareholder_id: str, cash_change: float):
-    shareholder = get_shareholder(db, shareholder_id)
-    if shareholder:
-        shareholder.cash += cash_change
-        db.add(shareholder)
+    if change_shareholder_cash(db, shareholder_id, cash_change):
         db.commit()
-        logger.info(f"Updated cash for shareholder {shareholder_id}: ${cash_change} change")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Updated cash for shareholder %s: $%s change", shareholder_id, cash_change)
     else:
-        logger.error(f"Shareholder {shareholder_id} not found for cash update")
+        logger.error("Shareholder %s not found for cash update", shareholder_id)
+
+_CASH_CHANGE_STMT = (
+    update(DBShareholder.__table__)
+    .where(DBShareholder.__table__.c.id == bindparam("shareholder_id"))
+    .values(cash=DBShareholder.__table__.c.cash + bindparam("cash_change"))
+)
 
-def get_transaction_history(db: Session, company_id: str = None, shareholder_id: str = None):
-    query = db.query(Transaction)
+def settle_trades(db: Session, trades: List[dict]) -> List[dict]:
+    # Moves the shares and cash of a batch of fills without committing: one executemany for the cash,
+    # one upsert executemany for the holdings and one sweep of emptied holdings, however many fills there are
+    cash_changes = {}
+    share_changes = {}
+    for trade in trades:
+        total_value = trade["shares"] * trade["price_per_share"]
+        cash_changes[trade["buyer_id"]] = cash_changes.get(trade["buyer_id"], 0) - total_value
+        cash_changes[trade["seller_id"]] = cash_changes.get(trade["seller_id"], 0) + total_value
+        buyer_key = (trade["buyer_id"], trade["company_id"])
+        seller_key = (trade["seller_id"], trade["company_id"])
+        share_changes[buyer_key] = share_changes.get(buyer_key, 0) + trade["shares"]
+        share_changes[seller_key] = share_changes.get(seller_key, 0) - trade["shares"]
+
+    # Netted per row first: PostgreSQL refuses to upsert the same row twice in one statement
+    cash_rows = [{"shareholder_id": shareholder_id, "cash_change": change} for shareholder_id, change in cash_changes.items() if change]
+    share_rows = [
+        {"shareholder_id": shareholder_id, "company_id": company_id, "shares": change}
+        for (shareholder_id, company_id), change in share_changes.items() if change
+    ]
+    if cash_rows:
+        db.execute(_CASH_CHANGE_STMT, cash_rows)
+    if share_rows:
+        add_portfolio_shares(db, share_rows)
+        db.execute(delete(DBPortfolio).where(
+            DBPortfolio.company_id.in_({row["company_id"] for row in share_rows}),
+            DBPortfolio.shares <= 0
+        ))
+    return trades
+
+def apply_fill(db: Session, buyer_id: str, seller_id: str, company_id: str, shares: int, price_per_share: float) -> dict:
+    # Settles one fill and returns the transaction row to record, so the matching engine commits
+    # a trade once instead of once per balance
+    return settle_trades(db, [{
+        "buyer_id": buyer_id,
+        "seller_id": seller_id,
+        "company_id": company_id,
+        "shares": shares,
+        "price_per_share": price_per_share
+    }])[0]
+
+def get_transaction_history(db: Session, company_id: str = None, shareholder_id: str = None, before_id: str = None, limit: int = 100):
+    # Keyset pagination: ids are time-ordered, so pass the last id of a page to get the next one
+    conditions = []
     if company_id:
-        query = query.filter(Transaction.company_id == company_id)
-    if shareholder_id:
-        query = query.filter((Transaction.buyer_id == shareholder_id) | (Transaction.seller_id == shareholder_id))
-    return query.order_by(Transaction.id.desc()).all()
+        conditions.append(Transaction.company_id == company_id)
+    if before_id:
+        conditions.append(Transaction.id < before_id)
+
+    if not shareholder_id:
+        return db.scalars(select(Transaction).where(*conditions).order_by(Transaction.id.desc()).limit(limit)).all()
+
+    # A buyer_id OR seller_id filter can't walk either index in id order, so every page would read and sort
+    # all of the shareholder's trades. Each UNION ALL branch walks its own (buyer_id, id) / (seller_id, id)
+    # index and stops after one page; the seller branch skips self-trades the buyer branch already has
+    branches = [
+        select(Transaction.__table__)
+        .where(side, *conditions)
+        .order_by(Transaction.id.desc())
+        .limit(limit)
+        .subquery()
+        for side in (
+            Transaction.buyer_id == shareholder_id,
+            (Transaction.seller_id == shareholder_id) & (Transaction.buyer_id != shareholder_id)
+        )
+    ]
+    page = union_all(*(select(branch) for branch in branches)).subquery()
+    transaction = aliased(Transaction, page)
+    return db.scalars(select(transaction).order_by(transaction.id.desc()).limit(limit)).all()
+
+_LATEST_TRANSACTION_PRICE_STMT = (
+    select(Transaction.price_per_share)
+    .where(Transaction.company_id == bindparam("company_id"))
+    .order_by(Transaction.id.desc())
+    .limit(1)
+)
+
+def get_latest_transaction_price(db: Session, company_id: str) -> Optional[float]:
+    return db.execute(_LATEST_TRANSACTION_PRICE_STMT, {"company_id": company_id}).scalar()
 
 def get_total_buy_orders(db: Session, company_id: str) -> int:
     total_shares = db.query(func.sum(Order.shares)).filter(
@@ -383,28 +776,37 @@ def get_total_buy_orders(db: Session, company_id: str) -> int:
 def get_lowest_sell_order(db: Session, company_id: str):
     return db.query(Order).filter(
         Order.company_id == company_id,
-        Order.order_type == OrderType.SELL
+        Order.order_type == OrderType.SELL,
+        Order.order_subtype == OrderSubType.LIMIT
     ).order_by(Order.price.asc()).first()
 
 def get_total_shares_held(db: Session, company_id: str) -> int:
-    total_shares = db.query(func.sum(DBPortfolio.shares)).filter(DBPortfolio.company_id == company_id).scalar()
+    # Fills only move shares between holders and a split recounts the total from the floored holdings,
+    # so the company total always equals the sum of holdings
+    total_shares = db.execute(
+        select(DBCompany.outstanding_shares).where(DBCompany.id == company_id)
+    ).scalar()
     return total_shares or 0
 
 from datetime import datetime, timedelta
 
 def get_cash_flow_statement(db: Session, company_id: str):
+    key = ("cash_flow_statement", company_id)
+    cached = _cache_get(key)
+    if cached is not None:
+        # Callers get their own copy, so changing a returned statement can't change the cached one
+        return deepcopy(cached)
     try:
-        company = db.query(DBCompany).filter(DBCompany.id == company_id).first()
+        company = db.get(DBCompany, company_id)
         if not company:
-            logger.error(f"Company with id {company_id} not found")
-            return None
-
-        # Get income statement for net income
-        income_statement = get_income_statement(db, company_id)
-        if not income_statement:
+            logger.error("Company with id %s not found", company_id)
             return None
 
-        net_income = income_statement['net_income']
+        # Net income from the company row already loaded, instead of fetching it again via get_income_statement
+        net_income = calculate_daily_income(
+            company.annual_revenue, company.cost_of_revenue_percentage, company.rd_spend_percentage,
+            company.issued_bonds, company.issued_debt
+        ).net_income
 
         # Calculate Cash from Operations (CFO)
         cfo = net_income + company.gain_loss_investments + company.interest_income - company.change_in_nwc
@@ -424,7 +826,7 @@ def get_cash_flow_statement(db: Session, company_id: str):
         # Calculate Free Cash Flow
         free_cash_flow = cfo - company.capex
 
-        return {
+        statement = {
             "Cash from Operations (CFO)": {
                 "Net Income": net_income,
                 "Gain/Loss from Sale of Investments": company.gain_loss_investments,
@@ -446,159 +848,236 @@ def get_cash_flow_statement(db: Session, company_id: str):
             "Net Change in Cash": net_change_in_cash,
             "Free Cash Flow": free_cash_flow
         }
+        _cache_set(key, deepcopy(statement), STATEMENTS_TTL)
+        return statement
     except Exception as e:
-        logger.error(f"Error generating cash flow statement for company {company_id}: {str(e)}")
+        logger.error("Error generating cash flow statement for company %s: %s", company_id, e)
         return None
 
-def update_company_daily(db: Session, company_id: str):
-    company = db.query(DBCompany).filter(DBCompany.id == company_id).first()
-    if not company:
-        logger.error(f"Company with id {company_id} not found")
-        return None
-    
-    current_date = get_simulation_date(db)
-
-    # Update revenue based on business assets
-    company.annual_revenue = company.business_assets
-    
-    # Calculate daily values
-    daily_revenue = company.annual_revenue / 365
-    daily_cost_of_revenue = daily_revenue * company.cost_of_revenue_percentage
+class DailyIncome(NamedTuple):
+    # Internal callers read single fields; get_income_statement turns it into a dict for the API and GUI
+    revenue: float
+    cost_of_revenue: float
+    gross_profit: float
+    rd_spend: float
+    operating_income: float
+    interest_expense: float
+    ebt: float
+    taxes: float
+    net_income: float
+
+def calculate_daily_income(annual_revenue, cost_of_revenue_percentage, rd_spend_percentage, issued_bonds, issued_debt):
+    # Pure arithmetic shared by the daily update and the income statement, no session needed
+    daily_revenue = annual_revenue / 365
+    daily_cost_of_revenue = daily_revenue * cost_of_revenue_percentage
     daily_gross_profit = daily_revenue - daily_cost_of_revenue
-    daily_rd_spend = daily_gross_profit * company.rd_spend_percentage
+    daily_rd_spend = daily_gross_profit * rd_spend_percentage
     daily_operating_income = daily_gross_profit - daily_rd_spend
-    daily_interest_expense = (company.issued_bonds + company.issued_debt) * 0.05 / 365  # Assuming 5% annual interest rate
+    daily_interest_expense = (issued_bonds + issued_debt) * 0.05 / 365  # Assuming 5% annual interest rate
     daily_ebt = daily_operating_income - daily_interest_expense
     daily_taxes = daily_ebt * 0.21  # 21% tax rate
     daily_net_income = daily_ebt - daily_taxes
 
+    return DailyIncome(
+        daily_revenue, daily_cost_of_revenue, daily_gross_profit, daily_rd_spend, daily_operating_income,
+        daily_interest_expense, daily_ebt, daily_taxes, daily_net_income
+    )
+
+def calculate_companies_daily(
+    business_assets, cost_of_revenue_percentage, rd_spend_percentage, issued_bonds, issued_debt,
+    short_term_investments, gain_loss_investments, working_capital, dividend_account, cash,
+    capex_allocation, dividend_allocation, cash_investment_allocation
+):
+    # One day of the company model for every company at once; each argument is a column, each result too
+    business_assets = np.asarray(business_assets, dtype=np.float64)
+    cost_of_revenue_percentage = np.asarray(cost_of_revenue_percentage, dtype=np.float64)
+    rd_spend_percentage = np.asarray(rd_spend_percentage, dtype=np.float64)
+    short_term_investments = np.asarray(short_term_investments, dtype=np.float64)
+    working_capital = np.asarray(working_capital, dtype=np.float64)
+    cash_investment_allocation = np.asarray(cash_investment_allocation, dtype=np.float64)
+
+    # Update revenue based on business assets
+    annual_revenue = business_assets
+
+    # Calculate daily values
+    daily_net_income = calculate_daily_income(
+        annual_revenue, cost_of_revenue_percentage, rd_spend_percentage,
+        np.asarray(issued_bonds, dtype=np.float64), np.asarray(issued_debt, dtype=np.float64)
+    ).net_income
+
     # Calculate daily interest income from short-term investments
-    daily_interest_income = company.short_term_investments * (0.03 / 365)
-    company.interest_income = daily_interest_income
-    company.short_term_investments += daily_interest_income
+    daily_interest_income = short_term_investments * (0.03 / 365)
+    short_term_investments = short_term_investments + daily_interest_income
 
     # Calculate Cash from Operations (CFO)
-    daily_cfo = daily_net_income + (company.gain_loss_investments / 365) + daily_interest_income
+    daily_cfo = daily_net_income + (np.asarray(gain_loss_investments, dtype=np.float64) / 365) + daily_interest_income
 
     # Update working capital (10% of business assets)
-    required_working_capital = company.business_assets * 0.1
-    working_capital_adjustment = required_working_capital - company.working_capital
-    
-    # Update change_in_nwc
-    company.change_in_nwc = working_capital_adjustment
-
-    if working_capital_adjustment > 0:
-        # Need to increase working capital
-        if daily_cfo >= working_capital_adjustment:
-            company.working_capital += working_capital_adjustment
-            daily_cfo -= working_capital_adjustment
-        else:
-            # Use CFO and short-term investments if needed
-            company.working_capital += daily_cfo
-            remaining_adjustment = working_capital_adjustment - daily_cfo
-            daily_cfo = 0
-            if company.short_term_investments >= remaining_adjustment:
-                company.short_term_investments -= remaining_adjustment
-                company.working_capital += remaining_adjustment
-            else:
-                company.working_capital += company.short_term_investments
-                company.short_term_investments = 0
-    elif working_capital_adjustment < 0:
-        # Excess working capital, move to CFO
-        company.working_capital = required_working_capital
-        daily_cfo -= working_capital_adjustment  # This adds to CFO because adjustment is negative
+    required_working_capital = business_assets * 0.1
+    working_capital_adjustment = required_working_capital - working_capital
+
+    # A shortfall is funded from CFO first (even a negative CFO), then from short-term investments;
+    # an excess (negative adjustment) is released back into CFO in full
+    from_cfo = np.where(
+        working_capital_adjustment > 0, np.minimum(working_capital_adjustment, daily_cfo), working_capital_adjustment
+    )
+    from_investments = np.minimum(working_capital_adjustment - from_cfo, short_term_investments)
+    working_capital = working_capital + from_cfo
+    working_capital = working_capital + from_investments
+    short_term_investments = short_term_investments - from_investments
+    daily_cfo = daily_cfo - from_cfo
 
     # Apply CEO's CAPEX decision
-    daily_capex = daily_cfo * company.ceo.capex_allocation
-    company.capex = daily_capex
-    company.business_assets += daily_capex
+    daily_capex = daily_cfo * np.asarray(capex_allocation, dtype=np.float64)
 
     # Calculate remaining CFO after CAPEX
     remaining_cfo = daily_cfo - daily_capex
 
     # Accumulate dividends in the dividend account
-    daily_dividends = remaining_cfo * company.ceo.dividend_allocation
-    company.dividend_account += daily_dividends
-
-    # Check if it's time for quarterly dividend payout
-    if is_quarter_end(current_date) and company.dividend_account > 0:
-        distribute_quarterly_dividends(db, company, current_date)
+    daily_dividends = remaining_cfo * np.asarray(dividend_allocation, dtype=np.float64)
 
     # Apply CEO's cash vs short-term investments decision to remaining CFO after dividend accumulation
     remaining_cfo_after_dividends = remaining_cfo - daily_dividends
-    cash_increase = remaining_cfo_after_dividends * company.ceo.cash_investment_allocation
-    investments_increase = remaining_cfo_after_dividends * (1 - company.ceo.cash_investment_allocation)
+    cash_increase = remaining_cfo_after_dividends * cash_investment_allocation
+    investments_increase = remaining_cfo_after_dividends * (1 - cash_investment_allocation)
 
-    company.cash += cash_increase
-    company.short_term_investments += investments_increase
+    return {
+        "annual_revenue": annual_revenue,
+        "interest_income": daily_interest_income,
+        "change_in_nwc": working_capital_adjustment,
+        "working_capital": working_capital,
+        "capex": daily_capex,
+        "business_assets": business_assets + daily_capex,
+        "dividend_account": np.asarray(dividend_account, dtype=np.float64) + daily_dividends,
+        "cash": np.asarray(cash, dtype=np.float64) + cash_increase,
+        "short_term_investments": short_term_investments + investments_increase,
+        # Simulate R&D effect on cost efficiency (simplified): small daily improvement
+        "cost_of_revenue_percentage": np.where(
+            rd_spend_percentage > 0, cost_of_revenue_percentage * 0.9999, cost_of_revenue_percentage
+        )
+    }
 
-    # Simulate R&D effect on cost efficiency (simplified)
-    if company.rd_spend_percentage > 0:
-        company.cost_of_revenue_percentage *= 0.9999  # Small daily improvement
+DAILY_COMPANY_COLUMNS = (
+    "business_assets", "cost_of_revenue_percentage", "rd_spend_percentage", "issued_bonds", "issued_debt",
+    "short_term_investments", "gain_loss_investments", "working_capital", "dividend_account", "cash"
+)
+DAILY_CEO_COLUMNS = ("capex_allocation", "dividend_allocation", "cash_investment_allocation")
+
+def update_company_daily(db: Session, company_id: str):
+    # The CEO's allocations are always needed, so load them with the company instead of lazily
+    company = db.get(DBCompany, company_id, options=[joinedload(DBCompany.ceo)])
+    if not company:
+        logger.error("Company with id %s not found", company_id)
+        return None
+    
+    current_date = get_simulation_date(db)
+
+    daily = calculate_companies_daily(
+        **{name: [getattr(company, name)] for name in DAILY_COMPANY_COLUMNS},
+        **{name: [getattr(company.ceo, name)] for name in DAILY_CEO_COLUMNS}
+    )
+    for key, values in daily.items():
+        setattr(company, key, values.tolist()[0])
+
+    # Check if it's time for quarterly dividend payout
+    if is_quarter_end(current_date) and company.dividend_account > 0:
+        distribute_quarterly_dividends(db, company, current_date)
 
     company.last_update = current_date
     db.commit()
+    invalidate_statements(company_id)
     return company
 
+def update_all_companies_daily(db: Session, current_date: datetime) -> int:
+    # One SELECT joined to the CEOs, the day computed as arrays, one bulk UPDATE; no commit here,
+    # the caller commits the day together with the new simulation date
+    rows = db.execute(
+        select(DBCompany.id, *(getattr(DBCompany, name) for name in DAILY_COMPANY_COLUMNS),
+               *(getattr(CEO, name) for name in DAILY_CEO_COLUMNS))
+        .join(CEO, CEO.company_id == DBCompany.id)
+    ).all()
+    if not rows:
+        return 0
+
+    ids, *columns = zip(*rows)
+    daily = calculate_companies_daily(*columns)
+    daily_lists = {key: values.tolist() for key, values in daily.items()}
+    updates = [
+        {"id": company_id, "last_update": current_date, **{key: values[i] for key, values in daily_lists.items()}}
+        for i, company_id in enumerate(ids)
+    ]
+    db.execute(update(DBCompany), updates)
+
+    # Payouts touch shareholder cash, so they stay per company, and only on quarter ends;
+    # the bulk UPDATE above bypasses the identity map, so reload the row it just wrote
+    if is_quarter_end(current_date):
+        for company_id, dividend_account in zip(ids, daily_lists["dividend_account"]):
+            if dividend_account > 0:
+                company = db.get(DBCompany, company_id, populate_existing=True)
+                distribute_quarterly_dividends(db, company, current_date)
+
+    for company_id in ids:
+        invalidate_statements(company_id)
+    return len(ids)
+
 def is_quarter_end(date: datetime) -> bool:
-    return date.month in [3, 6, 9, 12] and date.day == 31
+    # Last day of the month, so June and September (30 days) pay out too
+    return date.month in [3, 6, 9, 12] and (date + timedelta(days=1)).month != date.month
 
 def distribute_quarterly_dividends(db: Session, company: DBCompany, current_date: datetime):
     total_dividends = company.dividend_account
-    shareholders = db.query(DBPortfolio).filter(DBPortfolio.company_id == company.id).all()
-    total_shares = sum(shareholder.shares for shareholder in shareholders)
-    
-    for shareholder in shareholders:
-        dividend_share = (shareholder.shares / total_shares) * total_dividends
-        after_tax_dividend = dividend_share * 0.8  # 20% tax rate
-        shareholder_account = db.query(DBShareholder).filter(DBShareholder.id == shareholder.shareholder_id).first()
-        shareholder_account.cash += after_tax_dividend
-    
+    total_shares = db.execute(
+        select(func.coalesce(func.sum(DBPortfolio.shares), 0)).where(DBPortfolio.company_id == company.id)
+    ).scalar()
+
+    if total_shares:
+        # Credit every holder in one UPDATE joined to the portfolios instead of loading each account
+        dividend_share = DBPortfolio.shares / float(total_shares) * total_dividends
+        db.execute(
+            update(DBShareholder)
+            .where(DBShareholder.id == DBPortfolio.shareholder_id, DBPortfolio.company_id == company.id)
+            .values(cash=DBShareholder.cash + dividend_share * 0.8)  # 20% tax rate
+        )
+
     company.dividends_paid += total_dividends
     company.dividend_account = 0  # Empty the dividend account after payout
     company.last_dividend_payout_date = current_date
-    db.commit()
-    logger.info(f"Distributed quarterly dividends for company {company.id}: ${total_dividends:.2f}")
+    # No commit here, the daily update commits the payout with the rest of the day
+    db.flush()
+    logger.info("Distributed quarterly dividends for company %s: $%.2f", company.id, total_dividends)
 
 def get_income_statement(db: Session, company_id: str):
+    key = ("income_statement", company_id)
+    cached = _cache_get(key)
+    if cached is not None:
+        return deepcopy(cached)
     try:
-        company = db.query(DBCompany).filter(DBCompany.id == company_id).first()
+        company = db.get(DBCompany, company_id)
         if not company:
-            logger.error(f"Company with id {company_id} not found")
+            logger.error("Company with id %s not found", company_id)
             return None
 
-        daily_revenue = company.annual_revenue / 365
-        daily_cost_of_revenue = daily_revenue * company.cost_of_revenue_percentage
-        daily_gross_profit = daily_revenue - daily_cost_of_revenue
-        daily_rd_spend = daily_gross_profit * company.rd_spend_percentage
-        daily_operating_income = daily_gross_profit - daily_rd_spend
-        daily_interest_expense = (company.issued_bonds + company.issued_debt) * 0.05 / 365  # Assuming 5% annual interest rate
-        daily_ebt = daily_operating_income - daily_interest_expense
-        daily_taxes = daily_ebt * 0.21
-        daily_net_income = daily_ebt - daily_taxes
-
-        return {
-            "revenue": daily_revenue,
-            "cost_of_revenue": daily_cost_of_revenue,
-            "gross_profit": daily_gross_profit,
-            "rd_spend": daily_rd_spend,
-            "operating_income": daily_operating_income,
-            "interest_expense": daily_interest_expense,
-            "ebt": daily_ebt,
-            "taxes": daily_taxes,
-            "net_income": daily_net_income
-        }
+        statement = calculate_daily_income(
+            company.annual_revenue, company.cost_of_revenue_percentage, company.rd_spend_percentage,
+            company.issued_bonds, company.issued_debt
+        )._asdict()
+        _cache_set(key, deepcopy(statement), STATEMENTS_TTL)
+        return statement
     except Exception as e:
-        logger.error(f"Error generating income statement for company {company_id}: {str(e)}")
+        logger.error("Error generating income statement for company %s: %s", company_id, e)
         return None
 
 def get_balance_sheet(db: Session, company_id: str):
-    company = db.query(DBCompany).filter(DBCompany.id == company_id).first()
+    key = ("balance_sheet", company_id)
+    cached = _cache_get(key)
+    if cached is not None:
+        return deepcopy(cached)
+    company = db.get(DBCompany, company_id)
     if not company:
-        logger.error(f"Company with id {company_id} not found")
+        logger.error("Company with id %s not found", company_id)
         return None
 
-    return {
+    statement = {
         "Assets": {
             "Cash": company.cash,
             "Short-term Investments": company.short_term_investments,
@@ -617,90 +1096,91 @@ def get_balance_sheet(db: Session, company_id: str):
             "Total Equity": company.total_equity - company.dividend_account  # Update this line
         }
     }
+    _cache_set(key, deepcopy(statement), STATEMENTS_TTL)
+    return statement
 
 def get_company_by_founder(db: Session, founder_id: str):
     return db.query(DBCompany).filter(DBCompany.founder_id == founder_id).first()
 
-def get_next_dividend_date(current_date: datetime) -> datetime:
-    year = current_date.year
-    month = current_date.month
-    day = current_date.day
-
-    if month < 3 or (month == 3 and day <= 31):
-        return datetime(year, 3, 31)
-    elif month < 6 or (month == 6 and day <= 30):
-        return datetime(year, 6, 30)
-    elif month < 9 or (month == 9 and day <= 30):
-        return datetime(year, 9, 30)
-    elif month < 12 or (month == 12 and day <= 31):
-        return datetime(year, 12, 31)
-    else:
-        return datetime(year + 1, 3, 31)
+QUARTER_ENDS = ((3, 31), (6, 30), (9, 30), (12, 31))
 
-def execute_stock_split(db: Session, company_id: str, split_ratio: str):
-    company = db.query(DBCompany).filter(DBCompany.id == company_id).first()
-    if not company:
-        return False
+@lru_cache(maxsize=4096)
+def get_next_dividend_date(current_date: datetime) -> datetime:
+    # First quarter end on or after the date; (12, 31) is the last day of the year, so one always exists
+    month, day = QUARTER_ENDS[bisect_left(QUARTER_ENDS, (current_date.month, current_date.day))]
+    return datetime(current_date.year, month, day)
 
+def execute_stock_split(db: Session, company_id: str, split_ratio: str, check_price: bool = False) -> Optional[float]:
     numerator, denominator = map(int, split_ratio.split(':'))
-    
-    # Determine if it's a regular split or reverse split
-    is_reverse_split = numerator < denominator
 
-    # Update company's outstanding shares and stock price
-    if is_reverse_split:
-        company.outstanding_shares = company.outstanding_shares * numerator // denominator
-        company.stock_price = company.stock_price * denominator / numerator
-    else:
-        company.outstanding_shares = company.outstanding_shares * numerator // denominator
-        company.stock_price = company.stock_price * denominator / numerator
-
-    # Update all portfolios
-    portfolios = db.query(DBPortfolio).filter(DBPortfolio.company_id == company_id).all()
-    for portfolio in portfolios:
-        if is_reverse_split:
-            portfolio.shares = portfolio.shares * numerator // denominator
-        else:
-            portfolio.shares = portfolio.shares * numerator // denominator
-
-    # Update all open orders
-    orders = db.query(Order).filter(Order.company_id == company_id).all()
-    for order in orders:
-        if is_reverse_split:
-            order.shares = order.shares * numerator // denominator
-            if order.price:
-                order.price = order.price * denominator / numerator
-        else:
-            order.shares = order.shares * numerator // denominator
-            if order.price:
-                order.price = order.price * denominator / numerator
+    # A reverse split (numerator < denominator) is the same arithmetic, so one path covers both.
+    # The company row is rescaled server-side, so a price the matcher wrote since the caller read it isn't lost;
+    # with check_price the split only goes through while the price is still out of the $20-$100 band
+    conditions = [DBCompany.id == company_id]
+    if check_price:
+        conditions.append(DBCompany.stock_price > 100 if numerator > denominator else DBCompany.stock_price < 20)
 
     try:
+        new_price = db.execute(
+            update(DBCompany)
+            .where(*conditions)
+            .values(stock_price=DBCompany.stock_price * denominator / numerator)
+            .returning(DBCompany.stock_price)
+        ).scalar()
+        if new_price is None:
+            return None
+
+        # Portfolios and open orders are rescaled in one UPDATE per table instead of row by row
+        db.execute(
+            update(DBPortfolio)
+            .where(DBPortfolio.company_id == company_id)
+            .values(shares=DBPortfolio.shares * numerator // denominator)
+        )
+        db.execute(
+            update(Order)
+            .where(Order.company_id == company_id)
+            .values(shares=Order.shares * numerator // denominator, price=Order.price * denominator / numerator)
+        )
+        # Recounts from the already rescaled rows: each holding is floored on its own,
+        # so outstanding_shares stays equal to the sum of holdings rather than the scaled total
+        db.execute(
+            update(DBCompany)
+            .where(DBCompany.id == company_id)
+            .values(outstanding_shares=select(func.coalesce(func.sum(DBPortfolio.shares), 0)).where(
+                DBPortfolio.company_id == company_id
+            ).scalar_subquery())
+        )
         db.commit()
-        return True
+        invalidate_statements(company_id)
+        return new_price
     except Exception as e:
-        print(f"Error executing stock split: {str(e)}")
         db.rollback()
-        return False
-    
+        logger.error("Error executing stock split: %s", e)
+        return None
+
 def get_simulation_date(db: Session) -> datetime:
-    setting = db.query(GlobalSettings).filter(GlobalSettings.key == "simulation_date").first()
-    if setting:
-        return datetime.fromisoformat(setting.value)
-    return datetime(2020, 1, 1)  # Default start date
+    current_date = _cache_get("simulation_date")
+    if current_date is None:
+        setting = db.get(GlobalSettings, "simulation_date")
+        current_date = datetime.fromisoformat(setting.value) if setting else datetime(2020, 1, 1)  # Default start date
+        _cache_set("simulation_date", current_date, SIMULATION_DATE_TTL)
+    return current_date
 
 def update_simulation_date(db: Session, new_date: datetime):
-    setting = db.query(GlobalSettings).filter(GlobalSettings.key == "simulation_date").first()
-    if setting:
-        setting.value = new_date.isoformat()
-        setting.last_updated = datetime.now()
-    else:
+    result = db.execute(
+        update(GlobalSettings)
+        .where(GlobalSettings.key == "simulation_date")
+        .values(value=new_date.isoformat(), last_updated=datetime.now())
+    )
+    if result.rowcount == 0:
         new_setting = GlobalSettings(key="simulation_date", value=new_date.isoformat(), last_updated=datetime.now())
         db.add(new_setting)
     db.commit()
+    # Write-through, so the next read in this process doesn't go back to the database
+    _cache_set("simulation_date", new_date, SIMULATION_DATE_TTL)
 
 def init_simulation_date(db: Session):
-    setting = db.query(GlobalSettings).filter(GlobalSettings.key == "simulation_date").first()
+    setting = db.get(GlobalSettings, "simulation_date")
     if not setting:
         default_start_date = datetime(2020, 1, 1)
         new_setting = GlobalSettings(
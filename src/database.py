@@ -1,17 +1,103 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event, inspect, literal, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import redis
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./finance_sim.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./finance_sim.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine_options = {"insertmanyvalues_page_size": 1000}
+url = make_url(SQLALCHEMY_DATABASE_URL)
+if url.get_backend_name() == "sqlite":
+    # The ticks write from a second engine, so wait out a busy writer instead of failing after the 5 s default
+    engine_options["connect_args"] = {"check_same_thread": False, "timeout": 30}
+else:
+    # A bounded pool of warm connections for the GUI's short sessions; LIFO keeps reusing the most recently
+    # returned one, and pre-ping/recycle drop connections the server closed
+    engine_options.update(pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=1800, pool_use_lifo=True)
+    if url.get_driver_name() == "psycopg2":
+        # Send executemany batches as multi-row VALUES instead of one round trip per row
+        engine_options["executemany_mode"] = "values_plus_batch"
+        engine_options["executemany_batch_page_size"] = 1000
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine on the same database for the background loops, so their I/O doesn't block the event loop
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+async_engine_options = {"insertmanyvalues_page_size": 1000}
+if url.get_backend_name() == "sqlite":
+    async_engine_options["connect_args"] = {"check_same_thread": False, "timeout": 30}
+else:
+    async_engine_options.update(pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=1800, pool_use_lifo=True)
+async_url = url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+async_engine = create_async_engine(async_url, **async_engine_options)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+if url.get_backend_name() == "sqlite":
+    # WAL lets readers run alongside the writer and turns each commit into an append
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # read pages straight from the OS cache, up to 256 MiB
+        cursor.close()
+
+    # Only the ticks use the async engine; losing the last tick on a power cut is fine,
+    # so skip the fsync per commit there while orders and cash keep full durability
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def set_async_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+
 Base = declarative_base()
 
+def migrate_schema(bind):
+    # create_all only creates missing tables, so bring tables from an older database file up to date
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    # Existing rows take the model default instead of NULL
+                    default = literal(column.default.arg, column.type).compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+                    ddl += f" DEFAULT {default}"
+                conn.execute(text(ddl))
+
+        existing_indexes = {
+            table_name: {index["name"] for index in inspector.get_indexes(table_name)}
+            for table_name in inspector.get_table_names()
+        }
+        if "ix_portfolios_shareholder_company" not in existing_indexes.get("portfolios", set()):
+            # The unique index needs one row per holding, so fold duplicates into one of them;
+            # ids of older rows are random uuid4 strings, so MIN(id) is just a stable pick, not the oldest row
+            conn.execute(text(
+                "UPDATE portfolios SET shares = ("
+                "SELECT SUM(other.shares) FROM portfolios AS other "
+                "WHERE other.shareholder_id = portfolios.shareholder_id AND other.company_id = portfolios.company_id) "
+                "WHERE id IN (SELECT MIN(id) FROM portfolios GROUP BY shareholder_id, company_id HAVING COUNT(*) > 1)"
+            ))
+            conn.execute(text(
+                "DELETE FROM portfolios WHERE id NOT IN (SELECT MIN(id) FROM portfolios GROUP BY shareholder_id, company_id)"
+            ))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if table.name in existing_indexes and index.name not in existing_indexes[table.name]:
+                    index.create(conn)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,12 +1,40 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
                                QSlider, QPushButton, QSpinBox, QMessageBox, QDialog, QComboBox)
-from PySide6.QtCore import Qt, Signal
+from PySide6.QtCore import Qt, Signal, QObject, QRunnable, QThreadPool
+from contextlib import contextmanager
+import logging
 import crud
 from database import SessionLocal
 from sqlalchemy import func
 from models import DBCompany
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+class DbJobSignals(QObject):
+    result_ready = Signal(object)
+    failed = Signal(str)
+
+class DbJob(QRunnable):
+    # Runs fn(db, *args) on a pool thread with its own session; the result comes back to the GUI thread
+    # as a queued signal, so slots may touch widgets but must only read attributes the query already loaded
+    def __init__(self, signals, fn, *args):
+        super().__init__()
+        self.signals = signals
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        db = SessionLocal()
+        try:
+            result = self.fn(db, *self.args)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        finally:
+            db.close()
+        self.signals.result_ready.emit(result)
+
 class CEOWidget(QWidget):
     settings_updated = Signal()
 
@@ -14,8 +42,31 @@ class CEOWidget(QWidget):
         super().__init__()
         self.company_id = None
         self.current_user_id = None
+        self._db = None
         self.setup_ui()
 
+    @contextmanager
+    def session(self):
+        # Nested calls reuse the outermost session, so change_ceo and its update_ceo_info are one checkout and one transaction
+        if self._db is not None:
+            yield self._db
+            return
+        self._db = SessionLocal()
+        try:
+            yield self._db
+        finally:
+            self._db.close()
+            self._db = None
+
+    def run_db_job(self, fn, *args, on_done, on_failed):
+        # The signals object lives on the GUI thread and deletes itself once the result has been delivered
+        signals = DbJobSignals(self)
+        signals.result_ready.connect(on_done)
+        signals.failed.connect(on_failed)
+        signals.result_ready.connect(signals.deleteLater)
+        signals.failed.connect(signals.deleteLater)
+        QThreadPool.globalInstance().start(DbJob(signals, fn, *args))
+
     def setup_ui(self):
         layout = QVBoxLayout(self)
 
@@ -58,9 +109,12 @@ class CEOWidget(QWidget):
     def set_company_id(self, company_id):
         if self.company_id != company_id:
             self.company_id = company_id
-            self.load_company_settings()
             self.update_data()
-            self.update_change_ceo_button_visibility()
+            if company_id:
+                # Fills the CEO labels and the Change CEO button from one snapshot
+                self.load_company_settings()
+            else:
+                self.change_ceo_button.setVisible(False)
 
     def set_current_user_id(self, user_id):
         self.current_user_id = user_id
@@ -75,67 +129,78 @@ class CEOWidget(QWidget):
         dividend_percentage = self.dividend_slider.value() / 100
         cash_percentage = self.cash_inv_slider.value() / 100
 
-        db = SessionLocal()
-        try:
-            company = crud.get_company(db, self.company_id)
-            if company:
-                company.capex_percentage = capex_percentage
-                company.dividend_payout_percentage = dividend_percentage
-                company.cash_allocation = cash_percentage
-                db.commit()
-                db.refresh(company)
-                self.settings_updated.emit()
-                QMessageBox.information(self, "Success", f"Changes applied successfully. CAPEX: {capex_percentage:.2%}, Dividend Payout: {dividend_percentage:.2%}, Cash Allocation: {cash_percentage:.2%}")
-            else:
-                QMessageBox.warning(self, "Error", f"Company with ID {self.company_id} not found.")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to apply changes: {str(e)}")
-        finally:
-            db.close()
+        # The commit runs on a pool thread; on_apply_done reports back on the GUI thread
+        self.run_db_job(
+            self.save_company_settings, self.company_id, capex_percentage, dividend_percentage, cash_percentage,
+            on_done=self.on_apply_done,
+            on_failed=lambda message: QMessageBox.critical(self, "Error", f"Failed to apply changes: {message}")
+        )
+
+    @staticmethod
+    def save_company_settings(db, company_id, capex_percentage, dividend_percentage, cash_percentage):
+        company = crud.get_company(db, company_id)
+        if not company:
+            return None
+        company.capex_percentage = capex_percentage
+        company.dividend_payout_percentage = dividend_percentage
+        company.cash_allocation = cash_percentage
+        db.commit()
+        return capex_percentage, dividend_percentage, cash_percentage
+
+    def on_apply_done(self, result):
+        if result is None:
+            QMessageBox.warning(self, "Error", f"Company with ID {self.company_id} not found.")
+            return
+        capex_percentage, dividend_percentage, cash_percentage = result
+        self.settings_updated.emit()
+        QMessageBox.information(self, "Success", f"Changes applied successfully. CAPEX: {capex_percentage:.2%}, Dividend Payout: {dividend_percentage:.2%}, Cash Allocation: {cash_percentage:.2%}")
 
     def load_company_settings(self):
         if not self.company_id:
             return
 
-        db = SessionLocal()
-        try:
-            company = crud.get_company(db, self.company_id)
-            if company and company.ceo:
-                self.ceo_name_label.setText(f"CEO: {company.ceo.name}")
-                self.capex_label.setText(f"CAPEX Allocation: {company.ceo.capex_allocation:.2%}")
-                self.dividend_label.setText(f"Dividend Allocation: {company.ceo.dividend_allocation:.2%}")
-                self.cash_inv_label.setText(f"Cash/Investment Allocation: {company.ceo.cash_investment_allocation:.2%}")
-            else:
-                self.ceo_name_label.setText("CEO: N/A")
-                self.capex_label.setText("CAPEX Allocation: N/A")
-                self.dividend_label.setText("Dividend Allocation: N/A")
-                self.cash_inv_label.setText("Cash/Investment Allocation: N/A")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load company settings: {str(e)}")
-        finally:
-            db.close()
+        # One SELECT for the company, its CEO and the user's holding, off the GUI thread
+        company_id, user_id = self.company_id, self.current_user_id
+        self.run_db_job(
+            crud.get_company_snapshot, company_id, user_id,
+            on_done=lambda snapshot: self.apply_company_snapshot(snapshot, company_id, user_id),
+            on_failed=lambda message: QMessageBox.critical(self, "Error", f"Failed to load company settings: {message}")
+        )
+
+    def apply_company_snapshot(self, snapshot, company_id, user_id):
+        if company_id != self.company_id:
+            return  # the selection moved on while this one was loading
+        company = snapshot.company if snapshot else None
+        if company and company.ceo:
+            self.ceo_name_label.setText(f"CEO: {company.ceo.name}")
+            self.capex_label.setText(f"CAPEX Allocation: {company.ceo.capex_allocation:.2%}")
+            self.dividend_label.setText(f"Dividend Allocation: {company.ceo.dividend_allocation:.2%}")
+            self.cash_inv_label.setText(f"Cash/Investment Allocation: {company.ceo.cash_investment_allocation:.2%}")
+        else:
+            self.ceo_name_label.setText("CEO: N/A")
+            self.capex_label.setText("CAPEX Allocation: N/A")
+            self.dividend_label.setText("Dividend Allocation: N/A")
+            self.cash_inv_label.setText("Cash/Investment Allocation: N/A")
+        self.apply_change_ceo_visibility(snapshot, company_id, user_id)
 
     def update_data(self):
         if not self.company_id:
             return
 
-        db = SessionLocal()
-        try:
-            current_date = crud.get_simulation_date(db)
-            next_dividend_date = crud.get_next_dividend_date(current_date)
-            self.next_dividend_label.setText(f"Next Dividend Date: {next_dividend_date.strftime('%Y-%m-%d')}")
-        except Exception as e:
-            print(f"Error updating CEO widget data: {str(e)}")
-            self.next_dividend_label.setText("Next Dividend Date: Error")
-        finally:
-            db.close()
+        with self.session() as db:
+            try:
+                current_date = crud.get_simulation_date(db)
+                next_dividend_date = crud.get_next_dividend_date(current_date)
+                self.next_dividend_label.setText(f"Next Dividend Date: {next_dividend_date.strftime('%Y-%m-%d')}")
+            except Exception as e:
+                logger.error("Error updating CEO widget data: %s", e)
+                self.next_dividend_label.setText("Next Dividend Date: Error")
 
     def update_ceo_info(self):
         if not self.company_id:
             return
 
-        db = SessionLocal()
-        try:
+        with self.session() as db:
             company = crud.get_company(db, self.company_id)
             if company and company.ceo:
                 self.ceo_name_label.setText(f"CEO: {company.ceo.name}")
@@ -147,46 +212,32 @@ class CEOWidget(QWidget):
                 self.capex_label.setText("CAPEX Allocation: N/A")
                 self.dividend_label.setText("Dividend Allocation: N/A")
                 self.cash_inv_label.setText("Cash/Investment Allocation: N/A")
-        finally:
-            db.close()
 
     def update_change_ceo_button_visibility(self):
         if not self.company_id or not self.current_user_id:
             self.change_ceo_button.setVisible(False)
             return
 
-        db = SessionLocal()
-        try:
-            company = crud.get_company(db, self.company_id)
-            portfolio = crud.get_portfolio(db, self.current_user_id, self.company_id)
-            is_majority_shareholder = portfolio and portfolio.shares / company.outstanding_shares > 0.5
-            self.change_ceo_button.setVisible(is_majority_shareholder)
-            print(f"Change CEO button visibility updated. Is visible: {is_majority_shareholder}")  # Debug print
-        except Exception as e:
-            print(f"Error updating Change CEO button visibility: {str(e)}")  # Debug print
-        finally:
-            db.close()
+        company_id, user_id = self.company_id, self.current_user_id
+        self.run_db_job(
+            crud.get_company_snapshot, company_id, user_id,
+            on_done=lambda snapshot: self.apply_change_ceo_visibility(snapshot, company_id, user_id),
+            on_failed=lambda message: logger.error("Error updating Change CEO button visibility: %s", message)
+        )
 
-    def update_change_ceo_button_visibility(self):
-        if not self.company_id or not self.current_user_id:
-            self.change_ceo_button.setVisible(False)
+    def apply_change_ceo_visibility(self, snapshot, company_id, user_id):
+        # The holding belongs to the user the job was submitted for, so drop it if either selection changed
+        if company_id != self.company_id or user_id != self.current_user_id:
             return
-
-        db = SessionLocal()
-        try:
-            company = crud.get_company(db, self.company_id)
-            portfolio = crud.get_portfolio(db, self.current_user_id, self.company_id)
-            is_majority_shareholder = portfolio and portfolio.shares / company.outstanding_shares > 0.5
-            self.change_ceo_button.setVisible(is_majority_shareholder)
-        finally:
-            db.close()
+        outstanding_shares = snapshot.company.outstanding_shares if snapshot else 0
+        is_majority_shareholder = bool(user_id and snapshot and snapshot.shares and outstanding_shares) and snapshot.shares / outstanding_shares > 0.5
+        self.change_ceo_button.setVisible(is_majority_shareholder)
 
     def change_ceo(self):
         if not self.company_id or not self.current_user_id:
             return
 
-        db = SessionLocal()
-        try:
+        with self.session() as db:
             result, message = crud.change_ceo(db, self.company_id, self.current_user_id)
             if result:
                 QMessageBox.information(self, "Success", message)
@@ -194,35 +245,34 @@ class CEOWidget(QWidget):
                 self.settings_updated.emit()
             else:
                 QMessageBox.warning(self, "Error", message)
-        finally:
-            db.close()
 
     def show_stock_split_dialog(self):
         if not self.company_id:
             QMessageBox.warning(self, "Error", "No company selected.")
             return
 
-        db = SessionLocal()
-        try:
+        with self.session() as db:
             company = crud.get_company(db, self.company_id)
-            if not company:
-                QMessageBox.warning(self, "Error", f"Company with ID {self.company_id} not found.")
-                return
-
-            if company.stock_price < 20 or company.stock_price > 100:
-                dialog = StockSplitDialog(company.stock_price, self)
-                if dialog.exec():
-                    split_ratio = dialog.get_split_ratio()
-                    success = crud.execute_stock_split(db, self.company_id, split_ratio)
-                    if success:
-                        QMessageBox.information(self, "Success", f"Stock split ({split_ratio}) executed successfully.")
-                        self.settings_updated.emit()
-                    else:
-                        QMessageBox.warning(self, "Error", "Failed to execute stock split.")
-            else:
-                QMessageBox.information(self, "Information", "Stock split is only available when the stock price is below $20 or above $100.")
-        finally:
-            db.close()
+            stock_price = company.stock_price if company else None
+        if stock_price is None:
+            QMessageBox.warning(self, "Error", f"Company with ID {self.company_id} not found.")
+            return
+
+        if stock_price < 20 or stock_price > 100:
+            # The read above is already closed, so the dialog doesn't hold a transaction open;
+            # execute_stock_split re-checks the price band in its UPDATE
+            dialog = StockSplitDialog(stock_price, self)
+            if dialog.exec():
+                split_ratio = dialog.get_split_ratio()
+                with self.session() as db:
+                    new_price = crud.execute_stock_split(db, self.company_id, split_ratio, check_price=True)
+                if new_price is not None:
+                    QMessageBox.information(self, "Success", f"Stock split ({split_ratio}) executed successfully. New stock price: ${new_price:.2f}")
+                    self.settings_updated.emit()
+                else:
+                    QMessageBox.warning(self, "Error", "Failed to execute stock split. The stock price may have moved back into the $20-$100 range.")
+        else:
+            QMessageBox.information(self, "Information", "Stock split is only available when the stock price is below $20 or above $100.")
 
 class StockSplitDialog(QDialog):
     def __init__(self, stock_price, parent=None):
@@ -44,7 +44,7 @@ class PortfolioModel(QAbstractTableModel):
         portfolios = crud.get_shareholder_portfolio(db, shareholder_id)
         self.portfolio = []
         for portfolio in portfolios:
-            company = crud.get_company(db, portfolio.company_id)
+            company = portfolio.company
             total_value = portfolio.shares * company.stock_price
             # For simplicity, we're assuming the buy price was 90% of current price
             # In a real application, you'd calculate this based on actual purchase history
@@ -99,7 +99,7 @@ class OpenOrdersModel(QAbstractTableModel):
             orders = crud.get_shareholder_orders(db, self.user_id)
             self.orders = []
             for order in orders:
-                company = crud.get_company(db, order.company_id)
+                company = order.company
                 self.orders.append({
                     'company_name': company.name if company else "Unknown",
                     'order_type': order.order_type.value,
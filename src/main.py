@@ -4,7 +4,7 @@ from contextlib import asynccontextmanager
 from crud import run_company_ticks
 from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
 from sqlalchemy.orm import Session
-from database import engine, get_db, SessionLocal
+from database import engine, get_db, migrate_schema, SessionLocal
 from models import Base, Sector, CEO    
 from schemas import Shareholder, Company, Portfolio, OrderCreate, OrderResponse, TransactionResponse, OrderType, OrderSubType, MarketOrderResponse, IndividualInvestor, ShareholderType, IndividualInvestorType
 from typing import List, Union
@@ -21,6 +21,7 @@ logger = logging.getLogger(__name__)
 def create_tables():
     logger.info("Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    migrate_schema(engine)
     logger.info("Database tables created successfully.")
 
 create_tables()
@@ -30,38 +31,43 @@ db = SessionLocal()
 init_simulation_date(db)
 db.close()
 
+def match_all_companies():
+    db = SessionLocal()
+    try:
+        logger.info("Running automated order matching for all companies")
+        for company_id in crud.get_company_ids(db):
+            logger.info("Matching orders for company: %s", company_id)
+            match_orders(company_id, db, update_price=False)
+            cleanup_invalid_market_orders(db)
+        crud.refresh_all_stock_prices(db)
+        logger.info("Completed order matching for all companies")
+    except Exception as e:
+        logger.error("Error in automated order matching: %s", e)
+    finally:
+        db.close()
+
+def update_all_companies():
+    db = SessionLocal()
+    try:
+        current_date = get_simulation_date(db)
+        crud.update_all_companies_daily(db, current_date)
+        new_date = current_date + timedelta(days=1)
+        # Commits the day's updates and payouts with the new date, so a failure can't replay a day
+        update_simulation_date(db, new_date)
+    except Exception as e:
+        logger.error("Error in company updates: %s", e)
+    finally:
+        db.close()
+
+# The loop bodies use the blocking session, so run them in a worker thread to keep the event loop serving requests
 async def run_order_matching():
     while True:
-        db = SessionLocal()
-        try:
-            current_date = crud.get_simulation_date(db)
-            logger.info("Running automated order matching for all companies")
-            companies = crud.get_all_companies(db)
-            for company in companies:
-                logger.info(f"Matching orders for company: {company.name} (ID: {company.id})")
-                match_orders(company.id, db)          
-                cleanup_invalid_market_orders(db)
-            logger.info("Completed order matching for all companies")
-        except Exception as e:
-            logger.error(f"Error in automated order matching: {str(e)}")
-        finally:
-            db.close()
+        await asyncio.to_thread(match_all_companies)
         await asyncio.sleep(1)  # Wait for 1 second before the next round
 
 async def run_company_updates():
     while True:
-        db = SessionLocal()
-        try:
-            current_date = get_simulation_date(db)
-            companies = crud.get_all_companies(db)
-            for company in companies:
-                crud.update_company_daily(db, company.id)
-            new_date = current_date + timedelta(days=1)
-            update_simulation_date(db, new_date)
-        except Exception as e:
-            logger.error(f"Error in company updates: {str(e)}")
-        finally:
-            db.close()
+        await asyncio.to_thread(update_all_companies)
         await asyncio.sleep(1)  # Run every second (1 day in simulation)
 
 @asynccontextmanager
@@ -146,7 +152,7 @@ async def get_company(company_id: str, db: Session = Depends(get_db)):
 
 @app.get('/companies', response_model=List[Company])
 async def get_all_companies(db: Session = Depends(get_db)):
-    return crud.get_all_companies(db)
+    return crud.get_all_companies_with_ceo(db)
 
 @app.post('/orders', response_model=Union[OrderResponse, MarketOrderResponse])
 async def create_order(order: OrderCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
@@ -160,7 +166,8 @@ async def create_order(order: OrderCreate, background_tasks: BackgroundTasks, db
                 transactions = execute_market_order(db_order, db)
                 return MarketOrderResponse(
                     message=f"Market order executed: {len(transactions)} transactions",
-                    transactions=[TransactionResponse.from_orm(t) for t in transactions]
+                    # Fills come back as plain row dicts, not Transaction objects
+                    transactions=[TransactionResponse.model_validate(t) for t in transactions]
                 )
             except Exception as e:
                 logger.error(f"Error executing market order: {str(e)}")
@@ -186,8 +193,7 @@ async def cancel_order(order_id: str, db: Session = Depends(get_db)):
 
 @app.get('/shareholders/{shareholder_id}/orders', response_model=List[OrderResponse])
 async def get_shareholder_orders(shareholder_id: str, db: Session = Depends(get_db)):
-    shareholder = crud.get_shareholder(db, shareholder_id)
-    if not shareholder:
+    if not crud.shareholder_exists(db, shareholder_id):
         raise HTTPException(status_code=404, detail="Shareholder not found")
     orders = crud.get_shareholder_orders(db, shareholder_id)
     return [OrderResponse.from_orm(order) for order in orders]
@@ -201,14 +207,13 @@ async def get_portfolio(shareholder_id: str, db: Session = Depends(get_db)):
 
 @app.get('/order_book/{company_id}')
 async def get_order_book(company_id: str, db: Session = Depends(get_db)):
-    company = crud.get_company(db, company_id)
-    if not company:
+    if not crud.company_exists(db, company_id):
         raise HTTPException(status_code=404, detail="Company not found")
     return crud.get_order_book(db, company_id)
 
 @app.get('/transactions', response_model=List[TransactionResponse])
-async def get_transactions(company_id: str = None, shareholder_id: str = None, db: Session = Depends(get_db)):
-    transactions = crud.get_transaction_history(db, company_id, shareholder_id)
+async def get_transactions(company_id: str = None, shareholder_id: str = None, before_id: str = None, limit: int = 100, db: Session = Depends(get_db)):
+    transactions = crud.get_transaction_history(db, company_id, shareholder_id, before_id, limit)
     return [TransactionResponse.from_orm(t) for t in transactions]
 
 @app.get("/companies/{company_id}/income_statement")
@@ -1,6 +1,8 @@
 # models.py
+import os
+import time
 import uuid
-from sqlalchemy import Column, String, Float, Integer, ForeignKey, Enum as SQLAlchemyEnum, DateTime
+from sqlalchemy import Column, String, Float, Integer, ForeignKey, Enum as SQLAlchemyEnum, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy import func
 from database import Base
@@ -8,6 +10,18 @@ from enum import Enum
 from datetime import datetime
 import random
 
+def new_id() -> str:
+    # UUIDv7 (RFC 9562): the millisecond timestamp leads, so new keys append to the
+    # end of the primary-key index and sort in creation order
+    timestamp_ns = time.time_ns()
+    timestamp_ms, sub_ms = divmod(timestamp_ns, 1_000_000)
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    value |= 0x7 << 76  # version
+    value |= (sub_ms * 4096 // 1_000_000) << 64  # sub-millisecond precision keeps ids ordered within a millisecond
+    value |= 0x2 << 62  # variant
+    value |= int.from_bytes(os.urandom(8), "big") & 0x3FFFFFFFFFFFFFFF
+    return str(uuid.UUID(int=value))
+
 class GlobalSettings(Base):
     __tablename__ = "global_settings"
 
@@ -51,7 +65,7 @@ class IndividualInvestorType(str, Enum):
 class DBShareholder(Base):
     __tablename__ = "shareholders"
 
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True, default=new_id, index=True)
     name = Column(String, index=True)
     cash = Column(Float)
     type = Column(SQLAlchemyEnum(ShareholderType))
@@ -152,7 +166,7 @@ class Sector(str, Enum):
 class CEO(Base):
     __tablename__ = "ceos"
 
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True, default=new_id, index=True)
     name = Column(String, index=True)
     capex_allocation = Column(Float)
     dividend_allocation = Column(Float)
@@ -164,7 +178,7 @@ class CEO(Base):
     @classmethod
     def generate_random_ceo(cls):
         return cls(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             name=f"{random.choice(['John', 'Jane', 'Mike', 'Sarah', 'David', 'Emily'])} {random.choice(['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis'])}",
             capex_allocation=random.uniform(0, 1),
             dividend_allocation=random.uniform(0, 1),
@@ -174,7 +188,7 @@ class CEO(Base):
 class DBCompany(Base):
     __tablename__ = "companies"
 
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True, default=new_id, index=True)
     name = Column(String, index=True)
     stock_price = Column(Float)
     outstanding_shares = Column(Integer)
@@ -205,6 +219,13 @@ class DBCompany(Base):
     
     last_update = Column(DateTime, default=func.now())
 
+    # Tick performance metrics
+    revenue = Column(Float, default=0)
+    costs = Column(Float, default=0)
+    profit = Column(Float, default=0)
+    total_profit = Column(Float, default=0)
+    days_active = Column(Integer, default=0)
+
     # New fields for cash flow statement
     capex = Column(Float, default=0)
     gain_loss_investments = Column(Float, default=0)
@@ -259,7 +280,7 @@ class DBCompany(Base):
 class DBPortfolio(Base):
     __tablename__ = "portfolios"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()), index=True)
+    id = Column(String, primary_key=True, default=new_id, index=True)
     shareholder_id = Column(String, ForeignKey("shareholders.id"))
     company_id = Column(String, ForeignKey("companies.id"))
     shares = Column(Integer)
@@ -267,10 +288,15 @@ class DBPortfolio(Base):
     shareholder = relationship("DBShareholder", back_populates="portfolios")
     company = relationship("DBCompany", back_populates="portfolios")
 
+    __table_args__ = (
+        Index("ix_portfolios_shareholder_company", "shareholder_id", "company_id", unique=True),
+        Index("ix_portfolios_company", "company_id"),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True, default=new_id, index=True)
     shareholder_id = Column(String, ForeignKey("shareholders.id"))
     company_id = Column(String, ForeignKey("companies.id"))
     order_type = Column(SQLAlchemyEnum(OrderType))
@@ -278,12 +304,25 @@ class Order(Base):
     shares = Column(Integer)
     price = Column(Float, nullable=True)
 
+    company = relationship("DBCompany")
+
+    __table_args__ = (
+        Index("ix_orders_company_type_subtype_price", "company_id", "order_type", "order_subtype", "price"),
+        Index("ix_orders_shareholder_company_type", "shareholder_id", "company_id", "order_type"),
+    )
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True, default=new_id, index=True)
     buyer_id = Column(String, ForeignKey("shareholders.id"))
     seller_id = Column(String, ForeignKey("shareholders.id"))
     company_id = Column(String, ForeignKey("companies.id"))
     shares = Column(Integer)
-    price_per_share = Column(Float)
\ No newline at end of file
+    price_per_share = Column(Float)
+
+    __table_args__ = (
+        Index("ix_transactions_company_id", "company_id", "id"),
+        Index("ix_transactions_buyer_id", "buyer_id", "id"),
+        Index("ix_transactions_seller_id", "seller_id", "id"),
+    )
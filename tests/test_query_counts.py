@@ -0,0 +1,286 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import unittest
+from datetime import datetime
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import raiseload, sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import ShareholderType, IndividualInvestorType, Sector
+from schemas import OrderCreate, OrderType, OrderSubType
+import crud
+
+@contextmanager
+def count_queries(engine):
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+class TestQueryCounts(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(self.engine)
+        self.db = sessionmaker(bind=self.engine, expire_on_commit=False)()
+
+        # Any lazy load of a relationship is an N+1 in the making, so make it fail loudly
+        @event.listens_for(self.db, "do_orm_execute")
+        def _raise_on_lazy_load(state):
+            if state.is_select:
+                state.statement = state.statement.options(raiseload("*"))
+
+        crud.invalidate_cache("company_ids")
+        self.trader = crud.create_shareholder(self.db, "Trader", 10000, ShareholderType.INDIVIDUAL, IndividualInvestorType.VALUE)
+        self.founder = crud.create_shareholder(self.db, "Founder", 0, ShareholderType.INDIVIDUAL, IndividualInvestorType.GROWTH)
+        self.company = crud.create_company(self.db, "Query Corp", 100, 1000, self.founder.id, Sector.ENERGY)
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    def order(self, shareholder_id, order_type, shares, price):
+        return OrderCreate(
+            shareholder_id=shareholder_id,
+            company_id=self.company.id,
+            order_type=order_type,
+            order_subtype=OrderSubType.LIMIT,
+            shares=shares,
+            price=price
+        )
+
+    def test_create_order_issues_one_query(self):
+        with count_queries(self.engine) as queries:
+            order, error = crud.create_order(self.db, self.order(self.trader.id, OrderType.BUY, 10, 50))
+        self.assertIsNone(error)
+        self.assertEqual(len(queries), 1)
+
+    def test_rejected_order_issues_at_most_two_queries(self):
+        with count_queries(self.engine) as queries:
+            order, error = crud.create_order(self.db, self.order(self.trader.id, OrderType.SELL, 10, 50))
+        self.assertIsNone(order)
+        self.assertIn("Insufficient shares", error)
+        self.assertLessEqual(len(queries), 2)
+
+    def test_get_order_book_issues_one_query(self):
+        crud.create_order(self.db, self.order(self.trader.id, OrderType.BUY, 10, 50))
+        crud.create_order(self.db, self.order(self.founder.id, OrderType.SELL, 10, 150))
+        with count_queries(self.engine) as queries:
+            order_book = crud.get_order_book(self.db, self.company.id)
+        self.assertEqual(len(order_book["buy"]), 1)
+        self.assertEqual(len(order_book["sell"]), 1)
+        self.assertEqual(len(queries), 1)
+
+    def test_get_all_companies_with_ceo_does_not_scale_with_companies(self):
+        for i in range(5):
+            crud.create_company(self.db, f"Extra Corp {i}", 10, 100, self.founder.id, Sector.MATERIALS)
+        self.db.expunge_all()
+        with count_queries(self.engine) as queries:
+            companies = crud.get_all_companies_with_ceo(self.db)
+            ceo_names = [company.ceo.name for company in companies]
+        self.assertEqual(len(ceo_names), 6)
+        self.assertLessEqual(len(queries), 2)
+
+    def test_shareholder_portfolio_and_orders_load_companies_in_one_query(self):
+        crud.create_order(self.db, self.order(self.founder.id, OrderType.SELL, 10, 150))
+        self.db.expunge_all()
+        with count_queries(self.engine) as queries:
+            names = [p.company.name for p in crud.get_shareholder_portfolio(self.db, self.founder.id)]
+            names += [o.company.name for o in crud.get_shareholder_orders(self.db, self.founder.id)]
+        self.assertEqual(names, ["Query Corp", "Query Corp"])
+        self.assertEqual(len(queries), 2)
+
+    def test_get_company_ids_is_cached(self):
+        crud.get_company_ids(self.db)
+        with count_queries(self.engine) as queries:
+            company_ids = crud.get_company_ids(self.db)
+        self.assertEqual(company_ids, [self.company.id])
+        self.assertEqual(len(queries), 0)
+
+    def test_exists_checks_are_cached(self):
+        self.assertFalse(crud.company_exists(self.db, "missing"))
+        self.assertTrue(crud.company_exists(self.db, self.company.id))
+        with count_queries(self.engine) as queries:
+            self.assertTrue(crud.company_exists(self.db, self.company.id))
+        self.assertEqual(len(queries), 0)
+
+    def test_cash_and_portfolio_updates_issue_a_fixed_number_of_statements(self):
+        with count_queries(self.engine) as queries:
+            crud.update_shareholder_cash(self.db, self.trader.id, -100)
+        self.assertEqual(len(queries), 1)
+        with count_queries(self.engine) as queries:
+            crud.update_shareholder_portfolio(self.db, self.founder.id, self.company.id, -10)
+        # Holding update, emptied-holding cleanup and the company total
+        self.assertLessEqual(len(queries), 3)
+        self.assertEqual(crud.get_total_shares_held(self.db, self.company.id), 990)
+        with count_queries(self.engine) as queries:
+            crud.update_shareholder_portfolio(self.db, self.trader.id, self.company.id, 10)
+            crud.update_shareholder_portfolio(self.db, self.trader.id, self.company.id, 5)
+        # Each one is the holding upsert and the company total, whether or not the holding existed
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(crud.get_portfolio_shares(self.db, self.trader.id, self.company.id), 15)
+
+    def test_removing_more_than_held_retires_only_the_holding(self):
+        crud.update_shareholder_portfolio(self.db, self.trader.id, self.company.id, -5)
+        self.assertEqual(crud.get_total_shares_held(self.db, self.company.id), 1000)
+        crud.update_shareholder_portfolio(self.db, self.trader.id, self.company.id, 10)
+        crud.update_shareholder_portfolio(self.db, self.trader.id, self.company.id, -25)
+        self.assertIsNone(crud.get_portfolio(self.db, self.trader.id, self.company.id))
+        self.assertEqual(crud.get_total_shares_held(self.db, self.company.id), 1000)
+
+    def test_stock_split_recounts_outstanding_shares_from_floored_holdings(self):
+        crud.change_portfolio_shares(self.db, self.founder.id, self.company.id, -1)
+        crud.change_portfolio_shares(self.db, self.trader.id, self.company.id, 1)
+        self.db.commit()
+        crud.execute_stock_split(self.db, self.company.id, "1:2")
+        # 999 // 2 + 1 // 2, not 1000 // 2
+        self.assertEqual(crud.get_total_shares_held(self.db, self.company.id), 499)
+
+    def test_update_stock_price_reads_both_price_sources_in_one_query(self):
+        crud.execute_transaction(self.db, self.trader.id, self.founder.id, self.company.id, 10, 120)
+        with count_queries(self.engine) as queries:
+            price = crud.update_stock_price(self.db, self.company.id)
+        self.assertEqual(price, 120)
+        # One read, then the price UPDATE
+        self.assertEqual(len(queries), 2)
+
+    def test_refresh_all_stock_prices_issues_one_statement(self):
+        other = crud.create_company(self.db, "Other Corp", 50, 100, self.founder.id, Sector.MATERIALS)
+        idle = crud.create_company(self.db, "Idle Corp", 30, 100, self.founder.id, Sector.MATERIALS)
+        crud.create_order(self.db, self.order(self.founder.id, OrderType.SELL, 10, 150))
+        crud.execute_transaction(self.db, self.trader.id, self.founder.id, other.id, 10, 55)
+        with count_queries(self.engine) as queries:
+            changed = crud.refresh_all_stock_prices(self.db)
+        self.assertEqual(len(queries), 1)
+        # The idle company's price is unchanged, so its row isn't written
+        self.assertEqual(changed, 2)
+        self.assertEqual(crud.refresh_all_stock_prices(self.db), 0)
+        self.db.expire_all()
+        self.assertEqual(crud.get_company(self.db, self.company.id).stock_price, 150)
+        self.assertEqual(crud.get_company(self.db, other.id).stock_price, 55)
+        self.assertEqual(crud.get_company(self.db, idle.id).stock_price, 30)
+
+    def test_dividends_are_paid_in_a_fixed_number_of_statements(self):
+        crud.update_shareholder_portfolio(self.db, self.founder.id, self.company.id, -200)
+        for i in range(4):
+            holder = crud.create_shareholder(self.db, f"Holder {i}", 0, ShareholderType.INDIVIDUAL, IndividualInvestorType.VALUE)
+            crud.update_shareholder_portfolio(self.db, holder.id, self.company.id, 50)
+        self.company.dividend_account = 1000.0
+        self.db.commit()
+        with count_queries(self.engine) as queries:
+            crud.distribute_quarterly_dividends(self.db, self.company, datetime(2020, 3, 31))
+        # Total shares, one UPDATE for every holder, then the company row
+        self.assertEqual(len(queries), 3)
+        self.db.expire_all()
+        self.assertAlmostEqual(crud.get_shareholder(self.db, holder.id).cash, 50 / 1000 * 1000.0 * 0.8)
+        self.assertAlmostEqual(crud.get_shareholder(self.db, self.founder.id).cash, 800 / 1000 * 1000.0 * 0.8)
+
+    def test_financial_statements_are_cached_until_invalidated(self):
+        crud.invalidate_statements(self.company.id)
+        crud.get_balance_sheet(self.db, self.company.id)
+        self.db.expunge_all()
+        with count_queries(self.engine) as queries:
+            crud.get_balance_sheet(self.db, self.company.id)
+        self.assertEqual(len(queries), 0)
+        # update_company_daily drops them after every commit
+        crud.invalidate_statements(self.company.id)
+        with count_queries(self.engine) as queries:
+            crud.get_balance_sheet(self.db, self.company.id)
+        self.assertEqual(len(queries), 1)
+
+    def test_cached_statements_are_copies_dropped_by_a_split(self):
+        crud.invalidate_statements(self.company.id)
+        crud.get_balance_sheet(self.db, self.company.id)["Assets"]["Cash"] = -1
+        self.assertNotEqual(crud.get_balance_sheet(self.db, self.company.id)["Assets"]["Cash"], -1)
+        crud.execute_stock_split(self.db, self.company.id, "2:1")
+        self.db.expunge_all()
+        with count_queries(self.engine) as queries:
+            crud.get_balance_sheet(self.db, self.company.id)
+        self.assertEqual(len(queries), 1)
+
+    def test_daily_update_does_not_scale_with_companies(self):
+        for i in range(5):
+            crud.create_company(self.db, f"Extra Corp {i}", 10, 100, self.founder.id, Sector.MATERIALS)
+        with count_queries(self.engine) as queries:
+            updated = crud.update_all_companies_daily(self.db, datetime(2020, 1, 2))
+        self.assertEqual(updated, 6)
+        # One joined SELECT and one bulk UPDATE
+        self.assertEqual(len(queries), 2)
+
+    def test_update_company_daily_loads_the_ceo_with_the_company(self):
+        self.db.expunge_all()
+        # Would raise under the lazy-load guard if the CEO were fetched on access
+        company = crud.update_company_daily(self.db, self.company.id)
+        self.assertEqual(company.last_update, crud.get_simulation_date(self.db))
+
+    def test_settle_trades_does_not_scale_with_fills(self):
+        sellers = []
+        for i in range(4):
+            seller = crud.create_shareholder(self.db, f"Seller {i}", 0, ShareholderType.INDIVIDUAL, IndividualInvestorType.VALUE)
+            crud.update_shareholder_portfolio(self.db, seller.id, self.company.id, 10)
+            sellers.append(seller)
+        trades = [
+            {"buyer_id": self.trader.id, "seller_id": seller.id, "company_id": self.company.id, "shares": 10 - i, "price_per_share": 100.0}
+            for i, seller in enumerate(sellers)
+        ]
+        with count_queries(self.engine) as queries:
+            crud.settle_trades(self.db, trades)
+        # Cash executemany, holdings upsert executemany, emptied-holdings sweep
+        self.assertEqual(len(queries), 3)
+        self.db.commit()
+        self.assertEqual(crud.get_portfolio_shares(self.db, self.trader.id, self.company.id), 34)
+        self.assertIsNone(crud.get_portfolio(self.db, sellers[0].id, self.company.id))
+        self.assertEqual(crud.get_portfolio_shares(self.db, sellers[3].id, self.company.id), 3)
+        self.assertEqual(crud.get_shareholder_cash(self.db, self.trader.id), 10000 - 3400.0)
+        self.assertEqual(crud.get_shareholder_cash(self.db, sellers[1].id), 900.0)
+
+    def test_company_snapshot_loads_ceo_and_holding_in_one_query(self):
+        self.db.expunge_all()
+        with count_queries(self.engine) as queries:
+            snapshot = crud.get_company_snapshot(self.db, self.company.id, self.founder.id)
+            ceo_name = snapshot.company.ceo.name
+        self.assertTrue(ceo_name)
+        self.assertEqual(snapshot.shares, 1000)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(crud.get_company_snapshot(self.db, self.company.id, self.trader.id).shares, 0)
+        self.assertIsNone(crud.get_company_snapshot(self.db, "missing"))
+
+    def test_stock_split_rescales_the_company_without_reading_it(self):
+        self.assertIsNone(crud.execute_stock_split(self.db, self.company.id, "2:1", check_price=True))
+        with count_queries(self.engine) as queries:
+            new_price = crud.execute_stock_split(self.db, self.company.id, "1:5", check_price=False)
+        self.assertEqual(new_price, 500)
+        # Company row, portfolios, orders, then the recounted totals
+        self.assertEqual(len(queries), 4)
+        self.assertIsNone(crud.execute_stock_split(self.db, self.company.id, "1:2", check_price=True))
+        self.assertEqual(crud.execute_stock_split(self.db, self.company.id, "5:1", check_price=True), 100)
+        self.assertEqual(crud.get_portfolio_shares(self.db, self.founder.id, self.company.id), 1000)
+
+    def test_get_transaction_history_issues_one_query(self):
+        with count_queries(self.engine) as queries:
+            crud.get_transaction_history(self.db, company_id=self.company.id)
+        self.assertEqual(len(queries), 1)
+
+    def test_shareholder_history_pages_both_sides_in_one_query(self):
+        rows = [
+            crud.execute_transaction(self.db, buyer.id, seller.id, self.company.id, i + 1, 100)
+            for i, (buyer, seller) in enumerate([(self.trader, self.founder), (self.founder, self.trader), (self.trader, self.trader)] * 3)
+        ]
+        with count_queries(self.engine) as queries:
+            page = crud.get_transaction_history(self.db, shareholder_id=self.trader.id, limit=4)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([t.id for t in page], [row["id"] for row in rows[::-1][:4]])
+        rest = crud.get_transaction_history(self.db, shareholder_id=self.trader.id, before_id=page[-1].id)
+        # Self-trades show up once, not once per side
+        self.assertEqual([t.id for t in page + rest], [row["id"] for row in rows[::-1]])
+
+if __name__ == '__main__':
+    unittest.main()